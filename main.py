@@ -1,15 +1,29 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
+from src.app.services.mailing.logic import mailing_service
+from src.app.services.message.logic import message_service
 from src.core.config import settings
+from src.core.http import http_client
 from src.app.routers.subscriber import router as subscriber_router
 from src.app.routers.mailing import router as mailing_router
+from src.app.routers.dispatcher import router as dispatcher_router
+from src.app.routers.metrics import router as metrics_router
 
 
 def get_application():
     _app = FastAPI(title=settings.PROJECT_NAME)
     _app.include_router(subscriber_router)
     _app.include_router(mailing_router)
+    _app.include_router(dispatcher_router)
+    _app.include_router(metrics_router)
+
+    _app.add_event_handler("startup", http_client.start)
+    _app.add_event_handler("startup", message_service.status_buffer.start)
+    _app.add_event_handler("startup", mailing_service.start)
+    _app.add_event_handler("shutdown", mailing_service.stop)
+    _app.add_event_handler("shutdown", http_client.stop)
+    _app.add_event_handler("shutdown", message_service.status_buffer.stop)
 
     _app.add_middleware(
         CORSMiddleware,
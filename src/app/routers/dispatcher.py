@@ -0,0 +1,30 @@
+from fastapi import APIRouter
+
+from src.app.services.mailing.dispatcher import dispatcher
+from src.app.services.mailing.schemes import DispatcherStatus
+
+router = APIRouter(
+    prefix="/dispatcher",
+    tags=["dispatcher"],
+)
+
+
+@router.get(
+    path="/",
+    response_model=DispatcherStatus,
+    description="Returns sends in flight and waiting, and the current concurrency limit of this process",
+)
+async def get_dispatcher_status():
+    """
+    Returns dispatcher status
+
+    :return: DispatcherStatus
+    """
+
+    return DispatcherStatus(
+        in_flight=dispatcher.in_flight,
+        waiting=dispatcher.waiting,
+        limit=dispatcher.limit,
+        max_in_flight=dispatcher.max_in_flight,
+        min_rtt=dispatcher.limiter.min_rtt if dispatcher.limiter is not None else None,
+    )
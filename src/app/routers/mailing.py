@@ -1,11 +1,16 @@
-from typing import List
+import datetime
+import math
+from typing import List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.app.services.mailing.logic import mailing_service
 from src.app.services.mailing.schemes import Mailing, MailingCreate, MailingStats, MailingMessages, MailingUpdate, \
-    MailingDeletedResponse, MailingUpdatedResponse
+    MailingDeletedResponse, MailingUpdatedResponse, MailingState
+from src.app.services.message.models import MessageStatus
+from src.core.config import settings
 from src.core.database import get_db
 
 router = APIRouter(
@@ -29,7 +34,7 @@ async def create_mailing(mailing: MailingCreate, db: AsyncSession = Depends(get_
     """
 
     new_m = await mailing_service.create_mailing(session=db, obj_in=mailing)
-    mailing_service.schedule_mailing(session=db, mailing=new_m.to_pd())
+    mailing_service.schedule_mailing(mailing=new_m.to_pd())
     return new_m.to_pd()
 
 
@@ -53,22 +58,95 @@ async def get_mailings(db: AsyncSession = Depends(get_db)):
 @router.get(
     path="/{mailing_id}",
     response_model=MailingMessages,
-    description="Get mailing attributes with message list",
+    description="Get mailing attributes with a page of its messages ordered by id\n\n"
+                "Pass next_cursor of the previous page as cursor to get the next one",
     responses={404: {"description": "Mailing not found"}}
 )
-async def get_single_mailing(mailing_id: int, db: AsyncSession = Depends(get_db)):
+async def get_single_mailing(
+    mailing_id: int,
+    cursor: Optional[int] = None,
+    limit: int = Query(settings.PAGE_LIMIT_DEFAULT, ge=1, le=settings.PAGE_LIMIT_MAX),
+    status: Optional[MessageStatus] = None,
+    db: AsyncSession = Depends(get_db),
+):
     """
-    Returns mailing with messages if exists, 404 if not
+    Returns mailing with a page of messages if exists, 404 if not
 
     :param mailing_id: int
+    :param cursor: Optional[int]
+    :param limit: int
+    :param status: Optional[MessageStatus]
     :param db: AsyncSession
     :return: MailingMessages
     """
 
-    model = await mailing_service.get_mailing(id=mailing_id, session=db)
-    if not model:
+    mailing = await mailing_service.get_mailing(id=mailing_id, session=db, cursor=cursor, limit=limit, status=status)
+    if not mailing:
         raise HTTPException(status_code=404, detail="Mailing not found")
-    return model.to_ext()
+    return mailing
+
+
+@router.get(
+    path="/{mailing_id}/progress",
+    response_class=StreamingResponse,
+    description="Stream progress of a mailing running in this process as server-sent events\n\n"
+                "A progress event with throughput, counts, queue depth and projected completion is sent "
+                "every interval seconds, an end event when the mailing stops\n\n"
+                "Progress is kept in memory of the process holding the mailing lease, so with several "
+                "workers the request only succeeds on that one. Otherwise 409 is returned with the "
+                "mailing state and lease_owner, and Retry-After if the mailing runs in another process. "
+                "GET /mailings/{mailing_id} serves the projected completion stored by the lease owner "
+                "from any process",
+    responses={
+        404: {"description": "Mailing not found"},
+        409: {"description": "Mailing isn't running in this process"},
+    },
+)
+async def stream_mailing_progress(
+    mailing_id: int,
+    request: Request,
+    interval: float = Query(settings.PROGRESS_STREAM_INTERVAL, ge=0.1),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Streams mailing progress, 404 if not found, 409 if it isn't running in this process
+
+    The 409 detail carries mailing state and lease owner so clients can retry or route the request
+
+    :param mailing_id: int
+    :param request: Request
+    :param interval: float, seconds between events
+    :param db: AsyncSession
+    :return: StreamingResponse
+    """
+
+    if mailing_id not in mailing_service.mailers:
+        target_model = await mailing_service.get(session=db, id=mailing_id)
+        if not target_model:
+            raise HTTPException(status_code=404, detail="Mailing with given id not found")
+        running = target_model.state == MailingState.running
+        raise HTTPException(
+            status_code=409,
+            detail={
+                "msg": f"Mailing is {target_model.state.value}, not running in this process",
+                "state": target_model.state.value,
+                "lease_owner": target_model.lease_owner,
+            },
+            headers={"Retry-After": str(math.ceil(interval))} if running else None,
+        )
+
+    async def events():
+        async for progress in mailing_service.iter_progress(id=mailing_id, interval=interval):
+            if await request.is_disconnected():
+                return
+            yield f"event: progress\ndata: {progress.json()}\n\n"
+        yield "event: end\ndata: {}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @router.put(
@@ -76,7 +154,7 @@ async def get_single_mailing(mailing_id: int, db: AsyncSession = Depends(get_db)
     response_model=MailingUpdatedResponse,
     description="Update mailing if it's not running\n\nRequires datetime in naive format: 2022-08-19 14:35:58",
     responses={
-        400: {"description": "Can't update running mailing"},
+        400: {"description": "Can't update running mailing or only one end of its time window is set"},
         404: {"description": "Mailing not found"},
     },
 )
@@ -86,6 +164,8 @@ async def update_mailing(mailing_id: int, updated_obj: MailingUpdate, db: AsyncS
 
     Cannot update between start time and end time (returns 400 on attempt)
 
+    Time window is checked against the stored values of the fields that aren't updated
+
     404 if not found
 
     :param mailing_id: int
@@ -101,7 +181,14 @@ async def update_mailing(mailing_id: int, updated_obj: MailingUpdate, db: AsyncS
     if await mailing_service.is_running(id=mailing_id, session=db):
         raise HTTPException(status_code=400, detail="Can't update running mailing")
 
-    await mailing_service.update(session=db, db_obj=target_model, obj_in=updated_obj)
+    update_data = updated_obj.dict(exclude_unset=True)
+    window_start = update_data.get("window_start", target_model.window_start)
+    window_end = update_data.get("window_end", target_model.window_end)
+    if (window_start is None) != (window_end is None):
+        raise HTTPException(status_code=400, detail="window_start and window_end must be given together")
+
+    await mailing_service.update_mailing(session=db, db_obj=target_model, obj_in=updated_obj)
+    mailing_service.schedule_mailing(mailing=(await mailing_service.get(session=db, id=mailing_id)).to_pd())
     return MailingUpdatedResponse(id=mailing_id)
 
 
@@ -131,4 +218,100 @@ async def delete_mailing(mailing_id: int, db: AsyncSession = Depends(get_db)):
         raise HTTPException(status_code=400, detail="Can't delete running mailing")
 
     await mailing_service.delete(session=db, id=mailing_id)
+    mailing_service.unschedule_mailing(id=mailing_id)
     return MailingDeletedResponse(id=mailing_id)
+
+
+@router.post(
+    path="/{mailing_id}/pause",
+    response_model=Mailing,
+    description="Pause scheduled or running mailing\n\n"
+                "Messages are sent no more, resuming continues from the checkpoint",
+    responses={
+        400: {"description": "Can't pause mailing in its state"},
+        404: {"description": "Mailing not found"},
+    },
+)
+async def pause_mailing(mailing_id: int, db: AsyncSession = Depends(get_db)):
+    """
+    Pauses mailing, 400 if it's finished or canceled, 404 if not found
+
+    :param mailing_id: int
+    :param db: AsyncSession
+    :return: Mailing
+    """
+
+    target_model = await mailing_service.get(session=db, id=mailing_id)
+    if not target_model:
+        raise HTTPException(status_code=404, detail="Mailing with given id not found")
+
+    if not await mailing_service.pause_mailing(id=mailing_id):
+        raise HTTPException(status_code=400, detail=f"Can't pause {target_model.state.value} mailing")
+
+    await db.refresh(target_model)
+    return target_model.to_pd()
+
+
+@router.post(
+    path="/{mailing_id}/resume",
+    response_model=Mailing,
+    description="Resume paused mailing, it continues where it was paused if its time window is still open",
+    responses={
+        400: {"description": "Mailing isn't paused or its end time has passed"},
+        404: {"description": "Mailing not found"},
+    },
+)
+async def resume_mailing(mailing_id: int, db: AsyncSession = Depends(get_db)):
+    """
+    Resumes mailing, 400 if it isn't paused or its end time has passed, 404 if not found
+
+    A mailing past its end time would never be claimed again, it has to be updated with a new end time first
+
+    :param mailing_id: int
+    :param db: AsyncSession
+    :return: Mailing
+    """
+
+    target_model = await mailing_service.get(session=db, id=mailing_id)
+    if not target_model:
+        raise HTTPException(status_code=404, detail="Mailing with given id not found")
+
+    if target_model.end_time <= datetime.datetime.now():
+        raise HTTPException(status_code=400, detail="Can't resume mailing after its end time, update end_time first")
+
+    if not await mailing_service.resume_mailing(id=mailing_id):
+        raise HTTPException(status_code=400, detail=f"Can't resume {target_model.state.value} mailing")
+
+    await db.refresh(target_model)
+    mailing = target_model.to_pd()
+    mailing_service.schedule_mailing(mailing=mailing)
+    return mailing
+
+
+@router.post(
+    path="/{mailing_id}/cancel",
+    response_model=Mailing,
+    description="Cancel mailing that isn't finished, it won't run again unless updated",
+    responses={
+        400: {"description": "Mailing is finished"},
+        404: {"description": "Mailing not found"},
+    },
+)
+async def cancel_mailing(mailing_id: int, db: AsyncSession = Depends(get_db)):
+    """
+    Cancels mailing, 400 if it's finished, 404 if not found
+
+    :param mailing_id: int
+    :param db: AsyncSession
+    :return: Mailing
+    """
+
+    target_model = await mailing_service.get(session=db, id=mailing_id)
+    if not target_model:
+        raise HTTPException(status_code=404, detail="Mailing with given id not found")
+
+    if not await mailing_service.cancel_mailing(id=mailing_id):
+        raise HTTPException(status_code=400, detail=f"Can't cancel {target_model.state.value} mailing")
+
+    await db.refresh(target_model)
+    return target_model.to_pd()
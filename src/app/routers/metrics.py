@@ -0,0 +1,30 @@
+from fastapi import APIRouter, Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+
+from src.app.services.mailing.dispatcher import dispatcher
+from src.app.services.mailing.logic import mailing_service
+from src.core.metrics import ACTIVE_MAILERS, DISPATCHER_IN_FLIGHT, DISPATCHER_LIMIT, SCHEDULER_QUEUE_SIZE
+
+router = APIRouter(
+    tags=["metrics"],
+)
+
+# gauges are read when scraped, so keeping them doesn't cost anything on the send path
+SCHEDULER_QUEUE_SIZE.set_function(lambda: len(mailing_service.scheduler))
+ACTIVE_MAILERS.set_function(lambda: len(mailing_service.mailers))
+DISPATCHER_LIMIT.set_function(lambda: dispatcher.limit)
+DISPATCHER_IN_FLIGHT.set_function(lambda: dispatcher.in_flight)
+
+
+@router.get(
+    path="/metrics",
+    include_in_schema=False,
+)
+async def get_metrics():
+    """
+    Returns metrics of this process in Prometheus text format
+
+    :return: Response
+    """
+
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -1,11 +1,15 @@
-from typing import List
+from typing import Optional
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from src.app.services.mailing.logic import mailing_service
+from src.app.services.subscriber.bulk import BulkFormat, read_records, write_records, gzip_chunks
 from src.app.services.subscriber.logic import subscriber_service
 from src.app.services.subscriber.schemes import Subscriber, SubscriberCreate, SubscriberDeletedResponse, \
-    SubscriberUpdate
+    SubscriberUpdate, SubscriberPage, SubscriberImportResult
+from src.core.config import settings
 from src.core.database import get_db
 
 router = APIRouter(
@@ -16,19 +20,35 @@ router = APIRouter(
 
 @router.get(
     path="/",
-    response_model=List[Subscriber],
-    description="Get all subscribers",
+    response_model=SubscriberPage,
+    description="Get a page of subscribers ordered by id\n\n"
+                "Pass next_cursor of the previous page as cursor to get the next one",
 )
-async def get_subscribers(db: AsyncSession = Depends(get_db)):
+async def get_subscribers(
+    cursor: Optional[int] = None,
+    limit: int = Query(settings.PAGE_LIMIT_DEFAULT, ge=1, le=settings.PAGE_LIMIT_MAX),
+    tag: Optional[str] = None,
+    provider_code: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
+):
     """
-    Returns all subscribers
+    Returns a page of subscribers filtered by tag and provider code
 
+    :param cursor: Optional[int]
+    :param limit: int
+    :param tag: Optional[str]
+    :param provider_code: Optional[str]
     :param db: AsyncSession
-    :return: List[Subscriber]
+    :return: SubscriberPage
     """
 
-    models = await subscriber_service.get_many(session=db)
-    return [m.to_pd() for m in models if m]
+    return await subscriber_service.get_subscribers_page(
+        session=db,
+        cursor=cursor,
+        limit=limit,
+        tag=tag,
+        provider_code=provider_code,
+    )
 
 
 @router.post(
@@ -53,6 +73,71 @@ async def create_subscriber(subscriber: SubscriberCreate, db: AsyncSession = Dep
     return (await subscriber_service.get_by_phone(db, subscriber.phone)).to_pd()
 
 
+@router.post(
+    path="/import",
+    response_model=SubscriberImportResult,
+    description="Imports subscribers streamed in the request body, existing subscribers are updated by phone\n\n"
+                "CSV requires a header row with phone, provider_code, tag and time_zone columns, "
+                "NDJSON requires one object with these keys per line",
+)
+async def import_subscribers(request: Request, format: BulkFormat = BulkFormat.csv, db: AsyncSession = Depends(get_db)):
+    """
+    Bulk imports subscribers
+
+    :param request: Request
+    :param format: BulkFormat
+    :param db: AsyncSession
+    :return: SubscriberImportResult
+    """
+
+    records = read_records(request.stream(), fmt=format)
+    return await subscriber_service.import_subscribers(session=db, records=records)
+
+
+@router.get(
+    path="/export",
+    response_class=StreamingResponse,
+    description="Streams all subscribers or the audience of a mailing as CSV or NDJSON, optionally gzipped",
+    responses={404: {"description": "Mailing not found"}},
+)
+async def export_subscribers(
+    format: BulkFormat = BulkFormat.csv,
+    mailing_id: Optional[int] = None,
+    gzip: bool = False,
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Streams subscribers export
+
+    :param format: BulkFormat
+    :param mailing_id: Optional[int]
+    :param gzip: bool
+    :param db: AsyncSession
+    :return: StreamingResponse
+    """
+
+    mailing = None
+    if mailing_id is not None:
+        model = await mailing_service.get(session=db, id=mailing_id)
+        if not model:
+            raise HTTPException(status_code=404, detail="Mailing not found")
+        mailing = model.to_pd()
+
+    pages = subscriber_service.stream_subscribers(session=db, mailing=mailing)
+    body = write_records(pages, fmt=format)
+    media_type = "text/csv" if format == BulkFormat.csv else "application/x-ndjson"
+    filename = f"subscribers.{format.value}"
+    if gzip:
+        body = gzip_chunks(body)
+        media_type = "application/gzip"
+        filename += ".gz"
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
 @router.put(
     path="/{user_id}",
     response_model=Subscriber,
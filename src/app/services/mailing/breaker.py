@@ -0,0 +1,99 @@
+import asyncio
+import enum
+import logging
+import time
+from collections import deque
+
+
+class BreakerState(enum.Enum):
+    closed = "closed"
+    open = "open"
+    half_open = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Pauses sending while the upstream error rate is too high
+
+    The breaker opens when at least threshold of the last window outcomes (and no less than min_calls)
+    are errors. After cooldown seconds a single probe is let through: its success closes the breaker,
+    its failure opens it again
+    """
+
+    def __init__(self, name: str, window: int, min_calls: int, threshold: float, cooldown: float, poll: float):
+        self.window = window
+        self.min_calls = min_calls
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.poll = poll
+        self.state = BreakerState.closed
+        self.logger = logging.getLogger(name)
+        self._outcomes = deque(maxlen=window)
+        self._opened_at = 0.0
+        self._probing = False
+
+    async def wait(self) -> bool:
+        """
+        Waits until a call may be made
+
+        :return: bool, True if the call is the half-open probe, its outcome must be recorded or the probe aborted
+        """
+
+        while True:
+            if self.state == BreakerState.closed:
+                return False
+            if self.state == BreakerState.open:
+                remaining = self._opened_at + self.cooldown - time.monotonic()
+                if remaining > 0:
+                    await asyncio.sleep(remaining)
+                    continue
+                self.state = BreakerState.half_open
+            if not self._probing:
+                self._probing = True
+                return True
+            await asyncio.sleep(self.poll)
+
+    def abort_probe(self) -> None:
+        """
+        Lets another call probe the upstream when the probe was cancelled before its outcome was recorded
+
+        :return: None
+        """
+
+        if self.state == BreakerState.half_open:
+            self._probing = False
+
+    def record(self, success: bool) -> None:
+        """
+        Records a call outcome
+
+        :param success: bool
+        :return: None
+        """
+
+        if self.state == BreakerState.half_open:
+            if not self._probing:
+                return
+            self._probing = False
+            if success:
+                self.logger.warning("Circuit breaker closed")
+                self.state = BreakerState.closed
+                self._outcomes.clear()
+            else:
+                self._open()
+            return
+        if self.state == BreakerState.open:
+            return
+
+        self._outcomes.append(success)
+        if len(self._outcomes) < self.min_calls:
+            return
+        errors = self._outcomes.count(False)
+        if errors / len(self._outcomes) >= self.threshold:
+            self._open()
+
+    def _open(self) -> None:
+        self.logger.warning(f"Circuit breaker opened for {self.cooldown}s")
+        self.state = BreakerState.open
+        self._opened_at = time.monotonic()
+        self._outcomes.clear()
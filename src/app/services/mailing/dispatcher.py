@@ -0,0 +1,150 @@
+import asyncio
+import heapq
+import itertools
+import logging
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from src.app.services.mailing.limiter import AdaptiveLimiter
+from src.app.services.mailing.ratelimit import TokenBucket
+from src.core.config import settings
+
+
+class Dispatcher:
+    """
+    Process-wide budget of concurrent sends (and optionally sends per second) shared by all running mailings
+
+    When the budget is exhausted, waiting sends are granted by weighted fair queuing: every request gets
+    a virtual finish time 1/weight after the previous request of the same mailing (or the current virtual time
+    if the mailing was idle), and the request with the smallest one goes first. A mailing with twice the
+    weight gets twice the share of the budget while both are backlogged
+
+    With an adaptive limiter the number of concurrent sends is further capped by its current limit
+    """
+
+    def __init__(self, max_in_flight: int, rate: Optional[float], limiter: Optional[AdaptiveLimiter] = None):
+        self.max_in_flight = max_in_flight
+        self.limiter = limiter
+        self.rate_limiter = TokenBucket(rate=rate, capacity=rate) if rate else None
+        self.in_flight = 0
+        self.logger = logging.getLogger(__name__)
+        self._waiters: List[Tuple[float, int, asyncio.Future]] = []
+        self._counter = itertools.count()
+        self._finish: Dict[int, float] = {}
+        self._virtual_time = 0.0
+
+    @property
+    def limit(self) -> int:
+        if self.limiter is None:
+            return self.max_in_flight
+        return min(self.max_in_flight, self.limiter.limit)
+
+    @property
+    def waiting(self) -> int:
+        return sum(1 for *_, fut in self._waiters if not fut.done())
+
+    async def acquire(self, mailing_id: int, weight: float) -> None:
+        """
+        Waits for a send slot
+
+        :param mailing_id: int
+        :param weight: float
+        :return: None
+        """
+
+        finish = max(self._virtual_time, self._finish.get(mailing_id, 0.0)) + 1 / weight
+        self._finish[mailing_id] = finish
+        if self.in_flight < self.limit and not self._waiters:
+            self.in_flight += 1
+            self._virtual_time = finish
+        else:
+            fut = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._waiters, (finish, next(self._counter), fut))
+            try:
+                await fut
+            except asyncio.CancelledError:
+                if fut.done() and not fut.cancelled():
+                    self.release()
+                raise
+
+        if self.rate_limiter is not None:
+            try:
+                await self.rate_limiter.acquire()
+            except asyncio.CancelledError:
+                self.release()
+                raise
+
+    def release(self) -> None:
+        """
+        Frees a send slot and grants it to the waiter with the smallest virtual finish time
+
+        :return: None
+        """
+
+        self.in_flight -= 1
+        while self._waiters and self.in_flight < self.limit:
+            finish, _, fut = heapq.heappop(self._waiters)
+            if fut.done():
+                continue
+            self.in_flight += 1
+            self._virtual_time = finish
+            fut.set_result(None)
+
+    def record(self, started_at: float, latency: float, overloaded: bool) -> None:
+        """
+        Reports the outcome of a send made in a slot to the adaptive limiter, must be called before the slot is freed
+
+        :param started_at: float, time.monotonic() when the send started
+        :param latency: float, seconds
+        :param overloaded: bool, the upstream timed out, throttled or failed
+        :return: None
+        """
+
+        if self.limiter is not None:
+            self.limiter.record(started_at=started_at, latency=latency, overloaded=overloaded, in_flight=self.in_flight)
+
+    def forget(self, mailing_id: int) -> None:
+        """
+        Drops the fair queuing state of a finished mailing
+
+        :param mailing_id: int
+        :return: None
+        """
+
+        self._finish.pop(mailing_id, None)
+
+    @asynccontextmanager
+    async def slot(self, mailing_id: int, weight: float) -> AsyncIterator[None]:
+        await self.acquire(mailing_id=mailing_id, weight=weight)
+        try:
+            yield
+        finally:
+            self.release()
+
+
+def pool_bounded(limit: int) -> int:
+    """
+    Caps a number of concurrent sends at the HTTP connection pool size, 0 pool limits mean unlimited
+
+    Sends above the pool size wait for a connection inside aiohttp, which only inflates their latency
+
+    :param limit: int
+    :return: int
+    """
+
+    pool_limits = [p for p in (settings.HTTP_POOL_LIMIT, settings.HTTP_POOL_LIMIT_PER_HOST) if p > 0]
+    return min([limit] + pool_limits)
+
+
+dispatcher = Dispatcher(
+    max_in_flight=pool_bounded(settings.DISPATCHER_MAX_IN_FLIGHT),
+    rate=settings.DISPATCHER_RATE_LIMIT,
+    limiter=AdaptiveLimiter(
+        initial=settings.DISPATCHER_INITIAL_LIMIT,
+        min_limit=settings.DISPATCHER_MIN_LIMIT,
+        max_limit=pool_bounded(settings.DISPATCHER_MAX_IN_FLIGHT),
+        backoff=settings.DISPATCHER_LIMIT_BACKOFF,
+        tolerance=settings.DISPATCHER_LATENCY_TOLERANCE,
+        rtt_window=settings.DISPATCHER_RTT_WINDOW,
+    ) if settings.DISPATCHER_ADAPTIVE else None,
+)
@@ -0,0 +1,249 @@
+import asyncio
+import datetime
+import logging
+import os
+import socket
+import uuid
+from typing import Awaitable, Callable, Collection, Iterable, List, Optional
+
+from sqlalchemy import select, update, or_, func
+
+from src.app.services.mailing.models import MailingModel, MailingState
+from src.app.services.mailing.schemes import Mailing, MailingProgress
+from src.core.config import settings
+from src.core.database import SessionLocal
+from src.core.metrics import timed
+
+
+class Lease:
+    """
+    A claim of a mailing by this process
+
+    The token is stored in mailings.lease_owner and is different for every claim, so the lease
+    can only be renewed or released by the mailer started for this claim, not by one left over
+    from an earlier claim of the same mailing.
+    expires_at is on the event loop clock and counts from the start of the last successful claim or renewal,
+    which is never later than the database computed the expiry
+    """
+
+    def __init__(self, mailing: Mailing, token: str, expires_at: float):
+        self.mailing = mailing
+        self.token = token
+        self.expires_at = expires_at
+
+
+class MailingLeases:
+    """
+    Time-limited ownership of running mailings shared through the database
+
+    A process may only send a mailing while it holds the mailing lease. Due mailings are claimed
+    with SELECT ... FOR UPDATE SKIP LOCKED so that concurrent workers never claim the same mailing,
+    and a mailing whose owner stopped renewing the lease can be claimed by anyone once it expires.
+    Lease expiry is computed and compared on the database clock, so processes with skewed clocks agree on it
+    """
+
+    def __init__(self):
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.ttl = datetime.timedelta(seconds=settings.MAILING_LEASE_TTL)
+        self.renew_interval = settings.MAILING_LEASE_TTL / 4
+        self.logger = logging.getLogger(__name__)
+
+    @timed
+    async def claim(self, limit: int, exclude: Collection[int] = ()) -> List[Lease]:
+        """
+        Claims mailings that are due and not leased by anyone
+
+        :param limit: int, max number of mailings to claim
+        :param exclude: Collection[int], ids of mailings not to claim, such as ones this process still runs
+        :return: List[Lease]
+        """
+
+        now = datetime.datetime.now()
+        token = f"{self.owner}:{uuid.uuid4().hex[:8]}"
+        due = (
+            select(MailingModel.id)
+            .where(
+                MailingModel.state.in_([MailingState.scheduled, MailingState.running]),
+                MailingModel.start_time <= now,
+                MailingModel.end_time > now,
+                or_(MailingModel.lease_expires_at.is_(None), MailingModel.lease_expires_at < func.now()),
+            )
+        )
+        if exclude:
+            due = due.where(MailingModel.id.notin_(list(exclude)))
+        due = (
+            due
+            .order_by(MailingModel.start_time)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+            .scalar_subquery()
+        )
+        stmt = (
+            update(MailingModel)
+            .where(MailingModel.id.in_(due))
+            .values(state=MailingState.running, lease_owner=token, lease_expires_at=func.now() + self.ttl)
+            .returning(*MailingModel.__table__.c)
+            .execution_options(synchronize_session=False)
+        )
+        started_at = asyncio.get_running_loop().time()
+        expires_at = started_at + settings.MAILING_LEASE_TTL
+        async with SessionLocal() as session:
+            coro = await session.execute(stmt)
+            leases = [Lease(mailing=Mailing(**row), token=token, expires_at=expires_at) for row in coro.mappings()]
+            await session.commit()
+        if leases:
+            self.logger.warning(f"Claimed mailings {[lease.mailing.id for lease in leases]} as {token}")
+        return leases
+
+    @timed
+    async def renew(
+        self,
+        lease: Lease,
+        progress: Optional[MailingProgress] = None,
+        resume_after_id: Optional[int] = None,
+    ) -> bool:
+        """
+        Extends a lease that is still held, stores projected completion and checkpoint of the mailing if given
+
+        :param lease: Lease
+        :param progress: Optional[MailingProgress]
+        :param resume_after_id: Optional[int], id of the message up to which all messages are settled
+        :return: bool, False if the lease was lost
+        """
+
+        stmt = (
+            update(MailingModel)
+            .where(MailingModel.id == lease.mailing.id, MailingModel.lease_owner == lease.token)
+            .values(
+                lease_expires_at=func.now() + self.ttl,
+                **self.projection(progress),
+                **self.checkpoint(resume_after_id),
+            )
+            .execution_options(synchronize_session=False)
+        )
+        started_at = asyncio.get_running_loop().time()
+        async with SessionLocal() as session:
+            coro = await session.execute(stmt)
+            await session.commit()
+        if coro.rowcount != 1:
+            return False
+        lease.expires_at = started_at + settings.MAILING_LEASE_TTL
+        return True
+
+    async def keep(
+        self,
+        lease: Lease,
+        renew: Optional[Callable[[], Awaitable[bool]]] = None,
+        on_renewed: Optional[Callable[[], None]] = None,
+    ) -> None:
+        """
+        Renews the lease right away and then every MAILING_LEASE_TTL / 4 seconds,
+        returns once the lease is lost or may expire before another renewal completes
+
+        A renewal taking longer than the interval counts as failed. After a failed renewal the next one
+        ends at most two intervals later, so the lease is given up unless it expires after that
+
+        :param lease: Lease
+        :param renew: renews the lease, returns False if it was lost, renew() by default
+        :param on_renewed: called after every successful renewal
+        :return: None
+        """
+
+        loop = asyncio.get_running_loop()
+        interval = self.renew_interval
+        if renew is None:
+            async def renew():
+                return await self.renew(lease=lease)
+
+        while True:
+            started_at = loop.time()
+            try:
+                renewed = await asyncio.wait_for(renew(), timeout=interval)
+            except Exception as e:
+                self.logger.warning(f"Failed to renew lease of mailing {lease.mailing.id}: {e!r}")
+                if max(loop.time(), started_at + interval) + interval >= lease.expires_at:
+                    self.logger.warning(f"Lease of mailing {lease.mailing.id} is about to expire")
+                    return
+            else:
+                if not renewed:
+                    self.logger.warning(f"Lost lease of mailing {lease.mailing.id}")
+                    return
+                if on_renewed is not None:
+                    on_renewed()
+            await asyncio.sleep(max(0.0, started_at + interval - loop.time()))
+
+    @timed
+    async def release(
+        self,
+        lease: Lease,
+        state: MailingState,
+        progress: Optional[MailingProgress] = None,
+        resume_after_id: Optional[int] = None,
+    ) -> None:
+        """
+        Gives up a lease that is still held and sets mailing state
+
+        :param lease: Lease
+        :param state: MailingState
+        :param progress: Optional[MailingProgress]
+        :param resume_after_id: Optional[int], id of the message up to which all messages are settled
+        :return: None
+        """
+
+        stmt = (
+            update(MailingModel)
+            .where(MailingModel.id == lease.mailing.id, MailingModel.lease_owner == lease.token)
+            .values(
+                state=state,
+                lease_owner=None,
+                lease_expires_at=None,
+                **self.projection(progress),
+                **self.checkpoint(resume_after_id),
+            )
+            .execution_options(synchronize_session=False)
+        )
+        async with SessionLocal() as session:
+            await session.execute(stmt)
+            await session.commit()
+
+    @timed
+    async def revoke(self, mailing_id: int, state: MailingState, from_states: Iterable[MailingState]) -> bool:
+        """
+        Sets mailing state and drops its lease whoever holds it, if the mailing is in one of from_states
+
+        The holder notices on its next renewal and stops
+
+        :param mailing_id: int
+        :param state: MailingState
+        :param from_states: Iterable[MailingState]
+        :return: bool, False if the mailing is in another state
+        """
+
+        stmt = (
+            update(MailingModel)
+            .where(MailingModel.id == mailing_id, MailingModel.state.in_(list(from_states)))
+            .values(state=state, lease_owner=None, lease_expires_at=None)
+            .execution_options(synchronize_session=False)
+        )
+        async with SessionLocal() as session:
+            coro = await session.execute(stmt)
+            await session.commit()
+        return coro.rowcount == 1
+
+    @staticmethod
+    def projection(progress: Optional[MailingProgress]) -> dict:
+        if progress is None:
+            return {}
+        return {
+            "projected_finish_at": progress.projected_finish_at,
+            "projected_undelivered": progress.projected_undelivered,
+        }
+
+    @staticmethod
+    def checkpoint(resume_after_id: Optional[int]) -> dict:
+        if resume_after_id is None:
+            return {}
+        return {"resume_after_id": resume_after_id}
+
+
+mailing_leases = MailingLeases()
@@ -0,0 +1,82 @@
+import logging
+import time
+from typing import Optional
+
+
+class AdaptiveLimiter:
+    """
+    Limit of concurrent sends that adapts to the upstream with additive increase, multiplicative decrease
+
+    Every healthy response while the limit is in use raises it by 1/limit, so the limit grows by one per
+    round of sends. A timeout, connection error, 408, 429 or 5xx, or a latency above tolerance times
+    the lowest latency seen recently, cuts the limit by backoff. Only one cut is made per round: responses
+    to sends started before the previous cut don't cut it again
+    """
+
+    def __init__(
+        self,
+        initial: int,
+        min_limit: int,
+        max_limit: int,
+        backoff: float,
+        tolerance: float,
+        rtt_window: int,
+    ):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.tolerance = tolerance
+        self.rtt_window = rtt_window
+        self.logger = logging.getLogger(__name__)
+        self._limit = float(min(max(initial, min_limit), max_limit))
+        self._min_rtt: Optional[float] = None
+        self._next_min_rtt: Optional[float] = None
+        self._samples = 0
+        self._cut_at = 0.0
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    @property
+    def min_rtt(self) -> Optional[float]:
+        return self._min_rtt
+
+    def record(self, started_at: float, latency: float, overloaded: bool, in_flight: int) -> None:
+        """
+        Adjusts the limit by the outcome of a send
+
+        :param started_at: float, time.monotonic() when the send started
+        :param latency: float, seconds
+        :param overloaded: bool, the upstream timed out, throttled or failed
+        :param in_flight: int, sends in flight including this one
+        :return: None
+        """
+
+        if not overloaded:
+            self._sample_rtt(latency)
+            if self._min_rtt is None or latency <= self.tolerance * self._min_rtt:
+                # don't grow the limit while it's not what holds sends back
+                if in_flight >= self.limit:
+                    self._limit = min(self.max_limit, self._limit + 1 / self._limit)
+                return
+
+        if started_at < self._cut_at:
+            return
+        self._cut_at = time.monotonic()
+        limit = max(self.min_limit, self._limit * self.backoff)
+        if int(limit) != self.limit:
+            self.logger.warning(f"Send concurrency limit {self.limit} -> {int(limit)}, "
+                                f"latency {latency:.3f}s, {'overloaded' if overloaded else 'slow'}")
+        self._limit = limit
+
+    def _sample_rtt(self, latency: float) -> None:
+        # windowed minimum, so the baseline follows the upstream when it gets slower for good
+        self._samples += 1
+        self._next_min_rtt = latency if self._next_min_rtt is None else min(self._next_min_rtt, latency)
+        if self._min_rtt is None or latency < self._min_rtt:
+            self._min_rtt = latency
+        if self._samples >= self.rtt_window:
+            self._min_rtt = self._next_min_rtt
+            self._next_min_rtt = None
+            self._samples = 0
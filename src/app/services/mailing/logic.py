@@ -1,22 +1,35 @@
 import asyncio
 import datetime
-from typing import List
-from collections import deque
+from typing import AsyncIterator, Dict, Iterable, List, Optional
 
-from sqlalchemy import select
+from sqlalchemy import select, func
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import selectinload
+from sqlalchemy.orm import joinedload
 
+from src.app.services.mailing.lease import Lease, mailing_leases
 from src.app.services.mailing.mailer import Mailer
 from src.app.services.mailing.models import MailingModel
-from src.app.services.mailing.schemes import MailingCreate, Mailing, MailingStats
+from src.app.services.mailing.scheduler import MailingScheduler
+from src.app.services.mailing.schemes import MailingCreate, Mailing, MailingStats, MailingUpdate, MailingState, \
+    MailingMessages, MailingProgress
+from src.app.services.message.logic import message_service
+from src.app.services.message.models import MessageModel, MessageStatus
 from src.app.services.subscriber.logic import subscriber_service
 from src.core.base_crud import CRUDBase
+from src.core.config import settings
+from src.core.database import SessionLocal
+from src.core.metrics import timed
 
 
 class MailingService(CRUDBase):
     def __init__(self):
         super().__init__(model=MailingModel)
+        self.scheduler = MailingScheduler(
+            on_due=self.start_due_mailings,
+            poll_interval=settings.MAILING_CLAIM_INTERVAL,
+        )
+        self.mailers: Dict[int, Mailer] = {}
+        self._starting: Dict[int, asyncio.Task] = {}
 
     async def create_mailing(self, session: AsyncSession, obj_in: MailingCreate) -> MailingModel:
         """
@@ -30,87 +43,324 @@ class MailingService(CRUDBase):
         model = await self.save(session=session, obj_in=obj_in)
         return model
 
-    def schedule_mailing(self, session: AsyncSession, mailing: Mailing) -> None:
+    async def update_mailing(self, session: AsyncSession, db_obj: MailingModel, obj_in: MailingUpdate) -> MailingModel:
         """
-        Starts poll task based on given mailing attributes
+        Updates mailing and puts it back to scheduled state, so that it runs again in its new time window
+
+        If the audience filter changes, undelivered messages to the old audience are deleted,
+        messages to the new one are created on the next run
 
         :param session: AsyncSession
+        :param db_obj: MailingModel
+        :param obj_in: MailingUpdate
+        :return: MailingModel
+        """
+
+        changes = obj_in.dict(exclude_unset=True)
+        audience_fields = ("user_filter", "filter_mode")
+        if any(field in changes and changes[field] != getattr(db_obj, field) for field in audience_fields):
+            deleted = await message_service.delete_undelivered_messages(session=session, mailing_id=db_obj.id)
+            self.logger.warning(f"Mailing {db_obj.id}: audience changed, deleted {deleted} undelivered messages")
+        db_obj.state = MailingState.scheduled
+        db_obj.materialized_at = None
+        db_obj.resume_after_id = None
+        return await self.update(session=session, db_obj=db_obj, obj_in=obj_in)
+
+    def schedule_mailing(self, mailing: Mailing) -> None:
+        """
+        Schedules mailing start, replaces the previous schedule if the mailing was already scheduled
+
         :param mailing: Mailing
         :return: None
         """
 
-        self.logger.warning("CREATED TASK")
-        asyncio.create_task(self.poll(db=session, mailing=mailing))
+        self.scheduler.schedule(mailing_id=mailing.id, start_time=mailing.start_time)
 
-    async def poll(self, db: AsyncSession, mailing: Mailing) -> None:
+    def unschedule_mailing(self, id: int) -> None:
         """
-        An asyncio task that waits for the mailing start time and initializes the mailing if it's not canceled
+        Removes mailing from the scheduler
+
+        :param id: int
+        :return: None
+        """
+
+        self.scheduler.cancel(mailing_id=id)
+
+    async def start(self) -> None:
+        """
+        Schedules all mailings that haven't run yet and starts the scheduler
+
+        Mailings left running by a crashed process are resumed by the first claim of the scheduler
+        once their leases expire, only their undelivered messages are sent
+
+        :return: None
+        """
+
+        now = datetime.datetime.now()
+        stmt = select(self.model).where(self.model.state == MailingState.scheduled, self.model.end_time > now)
+        interrupted = (
+            select(func.count())
+            .select_from(self.model)
+            .where(self.model.state == MailingState.running, self.model.end_time > now)
+        )
+        async with SessionLocal() as session:
+            coro = await session.execute(stmt)
+            for model in coro.scalars():
+                self.schedule_mailing(mailing=model.to_pd())
+            running = (await session.execute(interrupted)).scalar_one()
+        self.logger.warning(f"Scheduled {len(self.scheduler)} mailings, {running} running mailings to resume")
+        await self.scheduler.start()
+
+    async def stop(self) -> None:
+        """
+        Stops the scheduler and all mailers of this process, their mailings are left for other processes
+
+        :return: None
+        """
+
+        await self.scheduler.stop()
+        mailers = list(self.mailers.values())
+        for mailer in mailers:
+            mailer.stop()
+        await asyncio.gather(*(mailer.task for mailer in mailers), return_exceptions=True)
+
+    async def start_due_mailings(self) -> None:
+        """
+        Called by the scheduler, claims due mailings and starts them
+
+        Mailings that still have a mailer in this process aren't claimed, e.g. one paused and resumed
+        by another process before its old mailer noticed, so that a mailing never runs twice here
 
-        :param db: AsyncSession
-        :param mailing: Mailing
         :return: None
         """
 
         while True:
-            self.logger.warning(f"Polling for mailing id={mailing.id}")
-            await asyncio.sleep(3)
-            now = datetime.datetime.now()
-            if now > mailing.end_time:
+            busy = set(self.mailers) | set(self._starting)
+            leases = await mailing_leases.claim(limit=settings.MAILING_CLAIM_LIMIT, exclude=busy)
+            for lease in leases:
+                self.logger.warning(f"Initializing mailing {lease.mailing.id}")
+                task = asyncio.create_task(self.start_mailing(lease=lease))
+                self._starting[lease.mailing.id] = task
+                task.add_done_callback(lambda _, id=lease.mailing.id: self._starting.pop(id, None))
+            if len(leases) < settings.MAILING_CLAIM_LIMIT:
                 return
-            if now > mailing.start_time:
-                self.logger.warning(f"Initializing mailing {mailing.id}")
-                return await self.initialize_mailing_if_not_canceled(session=db, m=mailing)
 
-    async def initialize_mailing_if_not_canceled(self, session: AsyncSession, m: Mailing) -> None:
+    async def start_mailing(self, lease: Lease) -> None:
+        """
+        Initializes claimed mailing, the mailing lease expires if initialization fails
+
+        The lease is renewed meanwhile, since creating the messages of a large audience may take longer
+        than MAILING_LEASE_TTL. Initialization is cancelled if the lease is lost or may expire
+
+        :param lease: Lease
+        :return: None
+        """
+
+        async def initialize():
+            async with SessionLocal() as session:
+                await self.initialize_mailing_if_not_canceled(session=session, lease=lease)
+
+        initializing = asyncio.create_task(initialize())
+        keeper = asyncio.create_task(mailing_leases.keep(lease=lease))
+        keeper.add_done_callback(lambda _: initializing.cancel())
+        try:
+            await initializing
+        except asyncio.CancelledError:
+            if not keeper.done():
+                raise
+            self.logger.warning(f"Stopped initializing mailing {lease.mailing.id} without its lease")
+        except Exception as e:
+            self.logger.warning(f"Failed to initialize mailing {lease.mailing.id}: {e!r}")
+        finally:
+            keeper.cancel()
+
+    async def initialize_mailing_if_not_canceled(self, session: AsyncSession, lease: Lease) -> None:
         """
-        Checks if mailing still exists, gets its subscribers and initializes the mailing
+        Checks if mailing still exists and is leased by this claim, creates its pending messages
+        and initializes the mailing
+
+        Pending messages are created only on the first run, a resumed mailing goes on
+        with the messages it already has
 
         :param session: AsyncSession
-        :param m: Mailing
+        :param lease: Lease
         :return:
         """
 
-        model = await self.get(session=session, id=m.id)
-        if not model:
+        model = await self.get(session=session, id=lease.mailing.id)
+        if not model or model.state != MailingState.running or model.lease_owner != lease.token:
             return
         mailing = model.to_pd()
 
-        subscribers = await subscriber_service.get_mailing_subscribers(session=session, mailing=mailing)
-        subs_queue = deque(subscribers)
-        self.logger.warning(f"OBTAINED SUBSCRIBERS: {subs_queue}")
+        if model.materialized_at is None:
+            created = await message_service.create_pending_messages(
+                session=session,
+                mailing_id=mailing.id,
+                subscriber_ids=subscriber_service.audience_ids(mailing),
+            )
+            model.materialized_at = datetime.datetime.now()
+            await session.commit()
+            self.logger.warning(f"Mailing {mailing.id}: created {created} pending messages")
+        else:
+            self.logger.warning(f"Resuming mailing {mailing.id}")
+
+        mailer = Mailer(mailing=mailing, lease=lease)
+        self.mailers[mailing.id] = mailer
+        mailer.task.add_done_callback(lambda _: self.forget_mailer(mailer))
+
+    def forget_mailer(self, mailer: Mailer) -> None:
+        """
+        Removes a stopped mailer unless another mailer of the same mailing has replaced it
+
+        :param mailer: Mailer
+        :return: None
+        """
+
+        if self.mailers.get(mailer.mailing.id) is mailer:
+            del self.mailers[mailer.mailing.id]
+
+    async def iter_progress(self, id: int, interval: float) -> AsyncIterator[MailingProgress]:
+        """
+        Yields progress of a mailing running in this process every interval seconds until its mailer stops
+
+        Progress is read from the mailer memory, so watchers don't query the database
 
-        Mailer(mailing=mailing, subs=subs_queue, db=session)
+        :param id: int
+        :param interval: float
+        :return: AsyncIterator[MailingProgress]
+        """
+
+        while True:
+            mailer = self.mailers.get(id)
+            if mailer is None:
+                return
+            yield mailer.snapshot()
+            if mailer.task.done():
+                return
+            await asyncio.sleep(interval)
 
+    async def change_state(self, id: int, state: MailingState, from_states: Iterable[MailingState]) -> bool:
+        """
+        Puts mailing to given state if it's in one of from_states, its mailer is stopped
+
+        A mailer of this process is stopped right away and checkpoints its progress,
+        a mailer of another process stops on its next lease renewal
+
+        :param id: int
+        :param state: MailingState
+        :param from_states: Iterable[MailingState]
+        :return: bool, False if the mailing is in another state
+        """
+
+        mailer = self.mailers.get(id)
+        if mailer is not None:
+            mailer.stop(state=state)
+            await asyncio.gather(mailer.task, return_exceptions=True)
+        return await mailing_leases.revoke(mailing_id=id, state=state, from_states=from_states)
+
+    async def pause_mailing(self, id: int) -> bool:
+        """
+        Pauses scheduled or running mailing
+
+        :param id: int
+        :return: bool, False if the mailing can't be paused
+        """
+
+        paused = await self.change_state(
+            id=id,
+            state=MailingState.paused,
+            from_states=[MailingState.scheduled, MailingState.running, MailingState.paused],
+        )
+        if paused:
+            self.unschedule_mailing(id=id)
+        return paused
+
+    async def resume_mailing(self, id: int) -> bool:
+        """
+        Puts paused mailing back to scheduled state, it's claimed again right away if it's due
+
+        The caller should schedule the mailing
+
+        :param id: int
+        :return: bool, False if the mailing isn't paused
+        """
+
+        return await mailing_leases.revoke(
+            mailing_id=id,
+            state=MailingState.scheduled,
+            from_states=[MailingState.paused],
+        )
+
+    async def cancel_mailing(self, id: int) -> bool:
+        """
+        Cancels mailing that isn't finished, it won't run again unless updated
+
+        :param id: int
+        :return: bool, False if the mailing is finished
+        """
+
+        canceled = await self.change_state(
+            id=id,
+            state=MailingState.canceled,
+            from_states=[MailingState.scheduled, MailingState.running, MailingState.paused, MailingState.canceled],
+        )
+        if canceled:
+            self.unschedule_mailing(id=id)
+        return canceled
+
+    @timed
     async def get_mailing_stats(self, session: AsyncSession) -> List[MailingStats]:
         """
         Returns a list of mailings and message stats
 
+        Stats are read from the mailing_stats counters, so the messages table isn't scanned
+
         :param session: AsyncSession
         :return: List[MailingStats]
         """
 
-        stmt = select(self.model).options(selectinload(self.model.messages))
+        stmt = select(self.model).options(joinedload(self.model.stats)).order_by(self.model.id)
         coro = await session.execute(stmt)
-        db_obj_list = coro.scalars()
-        return [o.to_stats() for o in db_obj_list if o]
+        return [o.to_stats() for o in coro.scalars()]
 
-    async def get_mailing(self, id: int, session: AsyncSession) -> MailingModel:
+    async def get_mailing(
+        self,
+        id: int,
+        session: AsyncSession,
+        cursor: Optional[int],
+        limit: int,
+        status: Optional[MessageStatus] = None,
+    ) -> Optional[MailingMessages]:
         """
-        Returns MailingModel by id
+        Returns mailing by id with a page of its messages, optionally with given status
 
         :param id: int
         :param session: AsyncSession
-        :return: MailingModel
+        :param cursor: Optional[int]
+        :param limit: int
+        :param status: Optional[MessageStatus]
+        :return: Optional[MailingMessages]
         """
 
-        stmt = select(self.model).options(selectinload(self.model.messages)).where(self.model.id == id)
-        coro = await session.execute(stmt)
-        obj = coro.scalar()
-        return obj
+        model = await self.get(session=session, id=id)
+        if not model:
+            return None
+        filters = [MessageModel.mailing_id == id]
+        if status is not None:
+            filters.append(MessageModel.status == status)
+        messages, next_cursor = await message_service.get_page(
+            session=session,
+            cursor=cursor,
+            limit=limit,
+            filters=filters,
+        )
+        return model.to_ext(messages=messages, next_cursor=next_cursor)
 
     async def is_running(self, id: int, session: AsyncSession) -> bool:
         """
-        Checks if datetime.now() is between mailing start time and end time
+        Checks if mailing is running, or is scheduled and datetime.now() is between its start time and end time
+
+        Paused and canceled mailings aren't running
 
         :param id: int
         :param session: AsyncSession
@@ -119,7 +369,9 @@ class MailingService(CRUDBase):
 
         model = await self.get(session=session, id=id)
         now = datetime.datetime.now()
-        if model.start_time < now < model.end_time:
+        if model.state == MailingState.running and now < model.end_time:
+            return True
+        if model.state == MailingState.scheduled and model.start_time < now < model.end_time:
             return True
         else:
             return False
@@ -1,105 +1,588 @@
 import asyncio
 import datetime
+import heapq
+import itertools
 import logging
-from collections import deque
+import math
+import random
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
 
-import aiohttp
-from sqlalchemy.ext.asyncio import AsyncSession
-
-from src.app.services.mailing.schemes import Mailing
-from src.app.services.message.logic import message_service
+from src.app.services.mailing.breaker import BreakerState, CircuitBreaker
+from src.app.services.mailing.dispatcher import dispatcher
+from src.app.services.mailing.lease import Lease, mailing_leases
+from src.app.services.mailing.progress import Progress
+from src.app.services.mailing.ratelimit import TokenBucket, provider_limiter
+from src.app.services.mailing.schemes import Mailing, MailingProgress, MailingState
+from src.app.services.mailing.transport import transport
+from src.app.services.mailing.windows import DeliveryWindow
+from src.app.services.message.logic import ANY_TIME_ZONE, message_service
 from src.app.services.message.models import MessageStatus
-from src.app.services.message.schemes import MessageCreate
-from src.app.services.subscriber.schemes import Subscriber
+from src.app.services.message.schemes import QueuedMessage
 from src.core.config import settings
+from src.core.database import query_stats
+from src.core.metrics import MESSAGES_SENT, MESSAGE_RETRIES, UPSTREAM_LATENCY, UPSTREAM_RESPONSES
+
+
+def is_transient(status_code: Optional[int]) -> bool:
+    """
+    Tells whether a failed send may succeed on retry: timeouts, connection errors, 408, 429 and 5xx
+
+    :param status_code: Optional[int], None if no response was received
+    :return: bool
+    """
+
+    return status_code is None or status_code in (408, 429) or not 400 <= status_code < 500
+
+
+def is_rejected(status_code: Optional[int]) -> bool:
+    """
+    Tells whether the upstream rejected the message itself, so that it won't be accepted on retry: 400 and 422
+
+    :param status_code: Optional[int], None if no response was received
+    :return: bool
+    """
+
+    return status_code in (400, 422)
+
+
+def is_misconfigured(status_code: Optional[int]) -> bool:
+    """
+    Tells whether the upstream refused the request rather than the message, such as 401 and 403 on a bad token
+    or 404 and 405 on a wrong URL. Every message fails alike until the configuration is fixed
+
+    :param status_code: Optional[int], None if no response was received
+    :return: bool
+    """
+
+    return not is_transient(status_code) and not is_rejected(status_code)
 
 
 class Mailer:
-    def __init__(self, mailing: Mailing, subs: deque[Subscriber], db: AsyncSession):
+    def __init__(self, mailing: Mailing, lease: Lease):
         self.mailing = mailing
-        self.subs_q = subs
+        self.lease = lease
+        self.queue: asyncio.Queue[QueuedMessage] = asyncio.Queue(maxsize=settings.MAILER_PREFETCH)
+        self.retries: List[Tuple[float, int, QueuedMessage]] = []
+        self._retry_counter = itertools.count()
         self.logger = logging.getLogger(f"Mailer {mailing.id}")
-        self.db = db
-        self.headers = {"Authorization": f"Bearer {settings.AUTH_TOKEN}"}
-        asyncio.create_task(self.mail())
+        self.in_flight = 0
+        self.window = None
+        if mailing.window_start is not None and mailing.window_end is not None:
+            self.window = DeliveryWindow(start=mailing.window_start, end=mailing.window_end)
+        self.window_closes: Dict[str, datetime.datetime] = {}
+        self.rate_limiter = TokenBucket(rate=mailing.rate_limit) if mailing.rate_limit else None
+        self.breaker = CircuitBreaker(
+            name=f"Mailer {mailing.id}",
+            window=settings.BREAKER_WINDOW,
+            min_calls=settings.BREAKER_MIN_CALLS,
+            threshold=settings.BREAKER_ERROR_RATE,
+            cooldown=settings.BREAKER_COOLDOWN,
+            poll=settings.MAILER_IDLE_DELAY,
+        )
+        self.progress = Progress(
+            mailing_id=mailing.id,
+            end_time=mailing.end_time,
+            smoothing=settings.MAILER_THROUGHPUT_SMOOTHING,
+        )
+        self.max_workers = max(settings.MAILER_MAX_CONCURRENCY, mailing.concurrency)
+        self.outstanding: Set[int] = set()
+        self._cursors: Dict[Any, int] = {}
+        self._last_id = mailing.resume_after_id or 0
+        self.sent_metrics = {status: MESSAGES_SENT.labels(str(mailing.id), status.name) for status in MessageStatus}
+        self.lease_lost = False
+        self.leased = asyncio.Event()
+        self.stop_state: Optional[MailingState] = None
+        self._producer: Optional[asyncio.Task] = None
+        self._workers: List[asyncio.Task] = []
+        self.task = asyncio.create_task(self.mail())
 
     async def mail(self):
         """
-        Pops queue and sends messages until queue is empty or datetime.now() > mailing.end_time
+        Starts mailing.concurrency workers once the lease is renewed and waits until all of them are done
+
+        The mailing lease is renewed while the workers run. If the lease is lost the workers are stopped
+        and the mailing is left to its new owner, if the mailer is stopped the lease is released so that
+        another process can take the mailing over right away, or the mailing is put to the state it was stopped with
 
         :return: None
         """
 
-        while datetime.datetime.now() < self.mailing.end_time and self.subs_q:
-            try:
-                subscriber = self.subs_q.pop()
-            except IndexError:
-                continue
-            message_id = await self.get_message_id(subscriber=subscriber)
-            await self.send_message(subscriber=subscriber, message_id=message_id)
-            await asyncio.sleep(0.5)
+        queries, query_seconds = query_stats.count, query_stats.seconds
+        heartbeat = asyncio.create_task(self.heartbeat())
+        pacer = None
+        state = MailingState.running
+        try:
+            await self.leased.wait()
+            self.progress.remaining = await message_service.count_queued(mailing_id=self.mailing.id)
+            pacer = asyncio.create_task(self.pace_deadline())
+            self._producer = asyncio.create_task(self.produce())
+            self._workers = [asyncio.create_task(self.worker()) for _ in range(self.mailing.concurrency)]
+            await self.join_workers()
+            if self._producer.done() and self._producer.exception() is not None:
+                self.logger.warning(f"Failed to load messages: {self._producer.exception()!r}")
+            else:
+                state = MailingState.finished
+        except asyncio.CancelledError:
+            if self.stop_state is not None:
+                state = self.stop_state
+            elif not self.lease_lost:
+                raise
+        finally:
+            heartbeat.cancel()
+            if pacer is not None:
+                pacer.cancel()
+            if self._producer is not None:
+                self._producer.cancel()
+            for worker in self._workers:
+                worker.cancel()
+            dispatcher.forget(mailing_id=self.mailing.id)
+            await message_service.flush_statuses()
+            if not self.lease_lost:
+                await mailing_leases.release(
+                    lease=self.lease,
+                    state=state,
+                    progress=self.progress.to_pd(),
+                    resume_after_id=self.checkpoint(),
+                )
+            self.logger.warning(f"Mailing {self.mailing.id} {state.value}, "
+                                f"{self.queue.qsize() + len(self.retries)} messages left in queue")
+            for status in MessageStatus:
+                MESSAGES_SENT.remove(str(self.mailing.id), status.name)
+            elapsed = time.monotonic() - self.progress.started_at
+            completed = self.progress.completed
+            # queries are counted for the whole process, other mailings running meanwhile are included
+            queries = query_stats.count - queries
+            self.logger.warning(f"Mailing {self.mailing.id} completed {completed} messages in {elapsed:.1f}s, "
+                                f"{completed / elapsed if elapsed else 0:.1f} msg/s, {queries} queries "
+                                f"({query_stats.seconds - query_seconds:.2f}s), "
+                                f"{queries / completed if completed else 0:.3f} queries per message")
 
-    async def send_message(self, subscriber: Subscriber, message_id: int):
+    async def join_workers(self):
         """
-        Send message then add it to the database with the corresponding status
+        Waits until all workers are done, including ones added by pace_deadline while waiting
 
-        :param subscriber: Subscriber
-        :param message_id: int
         :return: None
         """
 
-        data = {
-            "id": message_id,
-            "phone": subscriber.phone,
-            "text": self.mailing.mail_text,
-        }
-        async with aiohttp.ClientSession(headers=self.headers) as session:
-            url = f"{settings.URL_BASE}/{message_id}"
-            resp = await session.post(
-                url=url,
-                json=data,
-            )
-            self.logger.warning(f"{url}   {resp.status}   {data}")
+        pending = set(self._workers)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_EXCEPTION)
+            for worker in done:
+                worker.result()
+            pending |= {worker for worker in self._workers if not worker.done()}
 
-            if resp.status != 200:
-                self.subs_q.appendleft(subscriber)
-                status = MessageStatus.failed
-            else:
-                status = MessageStatus.delivered
+    async def pace_deadline(self):
+        """
+        Samples throughput every MAILER_PACING_INTERVAL seconds and adds workers when the mailing falls behind
 
-        self.logger.warning(message_id)
-        new_message = MessageCreate(
-            id=message_id,
-            sent_at=datetime.datetime.now(),
-            status=status,
-            subscriber_id=subscriber.id,
+        :return: None
+        """
+
+        while True:
+            await asyncio.sleep(settings.MAILER_PACING_INTERVAL)
+            self.progress.sample()
+            self.scale()
+
+    def scale(self) -> None:
+        """
+        Adds workers so that the remaining messages are sent before mailing.end_time, up to max_workers
+
+        Workers are only added while they are the bottleneck: not when the queue is empty,
+        the circuit breaker is open or the mailing is already sending at its rate limit.
+        The number of workers at most doubles per call
+
+        :return: None
+        """
+
+        throughput = self.progress.throughput
+        required = self.progress.required_throughput()
+        if throughput <= 0 or throughput >= required or self.queue.empty():
+            return
+        if self.breaker.state != BreakerState.closed:
+            return
+        if self.rate_limiter is not None and throughput >= 0.9 * self.mailing.rate_limit:
+            return
+
+        workers = len(self._workers)
+        target = min(self.max_workers, 2 * workers, math.ceil(workers * required / throughput))
+        if target <= workers:
+            return
+        self.logger.warning(f"Sending {throughput:.1f} msg/s, {required:.1f} msg/s needed, "
+                            f"adding {target - workers} workers")
+        self._workers.extend(asyncio.create_task(self.worker()) for _ in range(target - workers))
+
+    async def produce(self):
+        """
+        Streams queued messages of the mailing into the queue
+
+        The queue is bounded by MAILER_PREFETCH, so at most that many messages plus one page
+        are held in memory regardless of the audience size
+
+        :return: None
+        """
+
+        if self.window is not None:
+            return await self.produce_by_time_zone()
+
+        self._cursors[ANY_TIME_ZONE] = self._last_id
+        pages = message_service.iter_queued_messages(
             mailing_id=self.mailing.id,
+            page_size=settings.MAILER_PREFETCH,
+            after_id=self._last_id,
         )
-        self.logger.warning(new_message)
-        await message_service.update_message(message_id=message_id, obj=new_message, db=self.db)
+        async for page in pages:
+            await self.enqueue(page, cursor=ANY_TIME_ZONE)
+        del self._cursors[ANY_TIME_ZONE]
+
+    async def enqueue(self, page: List[QueuedMessage], cursor: Any):
+        """
+        Puts a page of messages to the queue, they are tracked as outstanding until settled
+
+        :param page: List[QueuedMessage]
+        :param cursor: time zone bucket the page belongs to, ANY_TIME_ZONE if messages aren't bucketed
+        :return: None
+        """
+
+        self.outstanding.update(message.id for message in page)
+        self._last_id = max(self._last_id, page[-1].id)
+        self._cursors[cursor] = page[-1].id
+        for message in page:
+            await self.queue.put(message)
+
+    def settle(self, message: QueuedMessage) -> None:
+        """
+        Marks message as not to be sent again by this mailer, its final status is buffered already
+
+        :param message: QueuedMessage
+        :return: None
+        """
+
+        self.outstanding.discard(message.id)
 
-    async def get_message_id(self, subscriber: Subscriber) -> int:
+    def checkpoint(self) -> int:
         """
-        Gets id of existing pending message or creates one and returns id
+        Returns message id up to which all messages of the mailing are settled
+
+        Messages are loaded in id order, so that's right below the lowest outstanding message and
+        the lowest position of time zone buckets still being loaded. A resumed mailing loads messages after it
 
-        :param subscriber: Subscriber
         :return: int
         """
 
-        message = await message_service.get_by_subscriber_mailing(
-            subscriber_id=subscriber.id,
-            mailing_id=self.mailing.id,
-            db=self.db,
+        candidates = [message_id - 1 for message_id in self.outstanding]
+        candidates.extend(self._cursors.values())
+        return min(candidates, default=self._last_id)
+
+    async def produce_by_time_zone(self):
+        """
+        Streams queued messages bucketed by subscriber time zone, each bucket only while its delivery window is open
+
+        Buckets are kept in a heap keyed on the time their window opens. Open buckets are streamed page by page
+        in turns, a bucket whose window has closed is put back with the time it opens next
+
+        :return: None
+        """
+
+        now = datetime.datetime.now()
+        counter = itertools.count()
+        buckets = []
+        for time_zone in await message_service.get_queued_time_zones(mailing_id=self.mailing.id):
+            self._cursors[time_zone] = self._last_id
+            heapq.heappush(buckets, (self.window.next_open(time_zone, now), next(counter), time_zone, self._last_id))
+
+        while buckets:
+            opens_at, _, time_zone, after_id = buckets[0]
+            if opens_at >= self.mailing.end_time:
+                return
+            delay = (opens_at - datetime.datetime.now()).total_seconds()
+            if delay > 0:
+                self.logger.warning(f"Waiting {delay:.0f}s for delivery window of time zone {time_zone}")
+                await asyncio.sleep(delay)
+                continue
+
+            heapq.heappop(buckets)
+            now = datetime.datetime.now()
+            self.window_closes[time_zone] = self.window.closes_at(time_zone, now)
+            page = await message_service.get_queued_page(
+                mailing_id=self.mailing.id,
+                after_id=after_id,
+                limit=settings.MAILER_PREFETCH,
+                time_zone=time_zone,
+            )
+            if page:
+                await self.enqueue(page, cursor=time_zone)
+            if len(page) == settings.MAILER_PREFETCH:
+                next_open = self.window.next_open(time_zone, datetime.datetime.now())
+                heapq.heappush(buckets, (next_open, next(counter), time_zone, page[-1].id))
+            else:
+                del self._cursors[time_zone]
+
+    def window_opens(self, message: QueuedMessage) -> Optional[datetime.datetime]:
+        """
+        Returns None if the message may be sent now, otherwise when the delivery window of its recipient opens next
+
+        Usually only compares with the known close time of the recipient time zone bucket,
+        the window is computed again only once that time has passed
+
+        :param message: QueuedMessage
+        :return: Optional[datetime.datetime]
+        """
+
+        if self.window is None:
+            return None
+        now = datetime.datetime.now()
+        closes_at = self.window_closes.get(message.time_zone)
+        if closes_at is not None and now < closes_at:
+            return None
+        opens_at = self.window.next_open(message.time_zone, now)
+        if opens_at > now:
+            return opens_at
+        self.window_closes[message.time_zone] = self.window.closes_at(message.time_zone, now)
+        return None
+
+    def next_message(self) -> Optional[QueuedMessage]:
+        """
+        Returns next message to send, failed messages whose backoff has passed go first
+
+        :return: Optional[QueuedMessage]
+        """
+
+        if self.retries and self.retries[0][0] <= asyncio.get_running_loop().time():
+            return heapq.heappop(self.retries)[2]
+        try:
+            return self.queue.get_nowait()
+        except asyncio.QueueEmpty:
+            return None
+
+    def schedule_retry(self, message: QueuedMessage) -> None:
+        """
+        Puts failed message to the retry heap with exponential backoff and full jitter
+
+        The message is dropped if it has no attempts left
+
+        :param message: QueuedMessage
+        :return: None
+        """
+
+        if message.attempts >= settings.MESSAGE_MAX_ATTEMPTS:
+            self.progress.complete(delivered=False)
+            self.settle(message)
+            return
+        MESSAGE_RETRIES.inc()
+        backoff = min(
+            settings.MESSAGE_RETRY_MAX_DELAY,
+            settings.MESSAGE_RETRY_BASE_DELAY * 2 ** (message.attempts - 1),
         )
-        self.logger.warning(f"MESSAGE: {message}")
-        if not message:
-            self.logger.warning("CREATING MESSAGE")
-            message = await message_service.add_pending_message(
-                MessageCreate(
-                    status=MessageStatus.pending,
-                    mailing_id=self.mailing.id,
-                    subscriber_id=subscriber.id,
-                ),
-                db=self.db,
+        self.defer(message, until=datetime.datetime.now() + datetime.timedelta(seconds=random.uniform(0, backoff)))
+
+    def defer(self, message: QueuedMessage, until: datetime.datetime) -> None:
+        """
+        Puts message to the retry heap to be sent again at given time, drops it if that's after mailing.end_time
+
+        :param message: QueuedMessage
+        :param until: datetime.datetime
+        :return: None
+        """
+
+        if until >= self.mailing.end_time:
+            self.progress.complete(delivered=False)
+            self.settle(message)
+            return
+        ready_at = asyncio.get_running_loop().time() + (until - datetime.datetime.now()).total_seconds()
+        heapq.heappush(self.retries, (ready_at, next(self._retry_counter), message))
+
+    async def heartbeat(self):
+        """
+        Renews the mailing lease and checkpoints progress, stops the mailer if the lease was taken over
+        by another process, released by a pause or cancel, or may expire before it's renewed again
+
+        The deadline counts from the claim, which initialization kept renewing, so the mailer never sends
+        while another process may have claimed the mailing
+
+        :return: None
+        """
+
+        await mailing_leases.keep(lease=self.lease, renew=self.renew, on_renewed=self.leased.set)
+        self.logger.warning(f"Stopping mailing {self.mailing.id} without its lease")
+        self.abandon()
+
+    async def renew(self) -> bool:
+        """
+        Renews the mailing lease storing progress and checkpoint
+
+        Statuses are flushed before the checkpoint is stored, so that it never covers unwritten statuses
+
+        :return: bool, False if the lease was lost
+        """
+
+        checkpoint = self.checkpoint()
+        await message_service.flush_statuses()
+        return await mailing_leases.renew(lease=self.lease, progress=self.progress.to_pd(), resume_after_id=checkpoint)
+
+    def abandon(self) -> None:
+        """
+        Stops the mailer without releasing the lease, the mailing is left to whoever claims it next
+
+        :return: None
+        """
+
+        self.lease_lost = True
+        self.task.cancel()
+
+    def snapshot(self) -> MailingProgress:
+        """
+        Returns current progress of the mailing from memory, without touching the database
+
+        :return: MailingProgress
+        """
+
+        return self.progress.to_pd().copy(update={
+            "queued": self.queue.qsize(),
+            "retrying": len(self.retries),
+            "in_flight": self.in_flight,
+            "workers": sum(1 for worker in self._workers if not worker.done()),
+        })
+
+    def stop(self, state: Optional[MailingState] = None):
+        """
+        Stops sending, buffered statuses are flushed and the lease is released
+
+        :param state: Optional[MailingState], state to put the mailing to, it's left running
+            for another process to take over if not given
+        :return: None
+        """
+
+        self.stop_state = state
+        self.task.cancel()
+
+    async def worker(self):
+        """
+        Takes messages and sends them until all messages are sent or datetime.now() > mailing.end_time
+
+        Messages are taken and sent up to transport.batch_size at a time. The worker doesn't exit
+        while messages are still being loaded, retries are pending or other workers are still sending,
+        since a failed send may put the message back for a retry
+
+        :return: None
+        """
+
+        while datetime.datetime.now() < self.mailing.end_time:
+            messages = self.next_batch()
+            if not messages:
+                if self._producer.done() and not self.retries and not self.in_flight:
+                    return
+                await asyncio.sleep(settings.MAILER_IDLE_DELAY)
+                continue
+
+            self.in_flight += len(messages)
+            probe = False
+            try:
+                probe = await self.breaker.wait()
+                for message in messages:
+                    await self.pace(message=message)
+                await self.send_messages(messages=messages)
+            except BaseException:
+                # cancelled or failed before the outcome was recorded
+                if probe:
+                    self.breaker.abort_probe()
+                raise
+            finally:
+                self.in_flight -= len(messages)
+
+    def next_batch(self) -> List[QueuedMessage]:
+        """
+        Takes up to transport.batch_size messages that may be sent now, the rest are deferred until their window opens
+
+        :return: List[QueuedMessage]
+        """
+
+        messages = []
+        while len(messages) < transport.batch_size:
+            message = self.next_message()
+            if message is None:
+                break
+            opens_at = self.window_opens(message)
+            if opens_at is not None:
+                self.defer(message, until=opens_at)
+                continue
+            messages.append(message)
+        return messages
+
+    async def pace(self, message: QueuedMessage):
+        """
+        Waits so that sends of all workers don't exceed mailing.rate_limit messages per second
+        and the rate limit of the message provider
+
+        :param message: QueuedMessage
+        :return: None
+        """
+
+        if self.rate_limiter is not None:
+            await self.rate_limiter.acquire()
+        await provider_limiter.acquire(message.provider_code)
+
+    async def send_messages(self, messages: List[QueuedMessage]):
+        """
+        Sends messages with a single transport call then buffers their status updates
+
+        :param messages: List[QueuedMessage]
+        :return: None
+        """
+
+        async with dispatcher.slot(mailing_id=self.mailing.id, weight=self.mailing.priority):
+            started_at = time.monotonic()
+            status_codes = await transport.send(messages=messages, text=self.mailing.mail_text)
+            latency = time.monotonic() - started_at
+            dispatcher.record(
+                started_at=started_at,
+                latency=latency,
+                overloaded=all(code != 200 and is_transient(code) for code in status_codes),
             )
-        return message.id
+
+        UPSTREAM_LATENCY.observe(latency)
+        for status_code in status_codes:
+            UPSTREAM_RESPONSES.labels("none" if status_code is None else str(status_code)).inc()
+
+        sent_at = datetime.datetime.now()
+        for message, status_code in zip(messages, status_codes):
+            await self.handle_result(message=message, status_code=status_code, sent_at=sent_at)
+
+    async def handle_result(self, message: QueuedMessage, status_code: Optional[int], sent_at: datetime.datetime):
+        """
+        Buffers status update of a sent message, schedules a retry if the failure may be temporary
+
+        :param message: QueuedMessage
+        :param status_code: Optional[int], None if no response was received
+        :param sent_at: datetime.datetime
+        :return: None
+        """
+
+        # a misconfigured upstream isn't the message's fault, it doesn't use up an attempt
+        if not is_misconfigured(status_code):
+            message.attempts += 1
+        if status_code == 200:
+            status = MessageStatus.delivered
+            self.breaker.record(success=True)
+            self.progress.complete(delivered=True)
+        elif is_rejected(status_code):
+            # the upstream rejected the message itself, retrying won't help.
+            # it's reachable though, which is what the breaker tracks
+            status = MessageStatus.rejected
+            self.breaker.record(success=True)
+            self.progress.complete(delivered=False)
+        else:
+            # transient and configuration errors open the breaker, so that sending stops until they are gone
+            status = MessageStatus.failed
+            self.breaker.record(success=False)
+            self.schedule_retry(message)
+
+        await message_service.buffer_status(
+            message_id=message.id,
+            status=status,
+            sent_at=sent_at,
+            attempts=message.attempts,
+        )
+        self.sent_metrics[status].inc()
+        if status != MessageStatus.failed or message.attempts >= settings.MESSAGE_MAX_ATTEMPTS:
+            self.settle(message)
@@ -1,34 +1,59 @@
-from sqlalchemy import Column, Integer, String, DateTime
+from typing import Optional
+
+from sqlalchemy import Column, Integer, String, DateTime, Float, Enum, Index, Time
 from sqlalchemy.orm import relationship
 
-from src.app.services.mailing.schemes import Mailing, MailingStats, Stats, MailingMessages
-from src.app.services.message.models import MessageStatus
+from src.app.services.mailing.schemes import Mailing, MailingStats, Stats, MailingMessages, MailingState, \
+    FilterMode
 from src.core.database import Base
 
 
 class MailingModel(Base):
     __tablename__ = "mailings"
+    __table_args__ = (
+        Index("ix_mailings_state_start_time", "state", "start_time"),
+    )
     id = Column(Integer, primary_key=True)
     mail_text = Column(String)
     user_filter = Column(String)
+    filter_mode = Column(Enum(FilterMode), nullable=False, server_default=FilterMode.exact.name)
     start_time = Column(DateTime(timezone=False), nullable=False)
     end_time = Column(DateTime(timezone=False), nullable=False)
+    concurrency = Column(Integer, nullable=False, server_default="1")
+    rate_limit = Column(Float)
+    priority = Column(Integer, nullable=False, server_default="1")
+    window_start = Column(Time(timezone=False))
+    window_end = Column(Time(timezone=False))
+    state = Column(Enum(MailingState), nullable=False, server_default=MailingState.scheduled.name)
+    lease_owner = Column(String)
+    lease_expires_at = Column(DateTime(timezone=False))
+    projected_finish_at = Column(DateTime(timezone=False))
+    projected_undelivered = Column(Integer)
+    materialized_at = Column(DateTime(timezone=False))
+    resume_after_id = Column(Integer)
     messages = relationship("MessageModel")
+    stats = relationship("MailingStatsModel", uselist=False, lazy="noload")
 
     def to_pd(self):
         return Mailing(**self.__dict__)
 
     def to_stats(self):
-        failed = [m for m in self.messages if m and m.status == MessageStatus.failed]
-        delivered = [m for m in self.messages if m and m.status == MessageStatus.delivered]
-        d = self.__dict__
-        d.pop("messages")
-        return MailingStats(
-            messages=Stats(delivered=len(delivered), failed=len(failed)),
-            **d,
-        )
+        d = dict(self.__dict__)
+        d.pop("messages", None)
+        stats = d.pop("stats", None)
+        if stats is None:
+            counters = Stats(delivered=0, failed=0, pending=0)
+        else:
+            counters = Stats(
+                delivered=stats.delivered,
+                failed=stats.failed,
+                pending=stats.pending,
+                rejected=stats.rejected,
+                attempts=stats.attempts,
+            )
+        return MailingStats(messages=counters, **d)
 
-    def to_ext(self):
-        d = self.__dict__
-        d["messages"] = [m.to_pd() for m in self.messages if m]
-        return MailingMessages(**d)
+    def to_ext(self, messages: list, next_cursor: Optional[int]):
+        d = dict(self.__dict__)
+        d["messages"] = [m.to_pd() for m in messages if m]
+        return MailingMessages(next_cursor=next_cursor, **d)
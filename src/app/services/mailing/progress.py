@@ -0,0 +1,117 @@
+import datetime
+import math
+import time
+from typing import Optional
+
+from src.app.services.mailing.schemes import MailingProgress
+
+
+class Progress:
+    """
+    Tracks how many messages of a running mailing are left and how fast they are being completed
+
+    Throughput is an exponentially weighted moving average of messages completed per second,
+    sampled by calling sample() periodically
+    """
+
+    def __init__(self, mailing_id: int, end_time: datetime.datetime, smoothing: float):
+        self.mailing_id = mailing_id
+        self.end_time = end_time
+        self.smoothing = smoothing
+        self.remaining = 0
+        self.delivered = 0
+        self.failed = 0
+        self.throughput = 0.0
+        self._completed = 0
+        self._sampled_completed = 0
+        self.started_at = time.monotonic()
+        self._sampled_at = self.started_at
+        self._has_sample = False
+
+    @property
+    def completed(self) -> int:
+        return self._completed
+
+    def complete(self, delivered: bool) -> None:
+        """
+        Counts a message that won't be sent again in this run
+
+        :param delivered: bool
+        :return: None
+        """
+
+        self.remaining -= 1
+        self._completed += 1
+        if delivered:
+            self.delivered += 1
+        else:
+            self.failed += 1
+
+    def sample(self) -> None:
+        """
+        Updates throughput with messages completed since the previous sample
+
+        :return: None
+        """
+
+        now = time.monotonic()
+        elapsed = now - self._sampled_at
+        if elapsed <= 0:
+            return
+        rate = (self._completed - self._sampled_completed) / elapsed
+        if self._has_sample:
+            self.throughput = self.smoothing * rate + (1 - self.smoothing) * self.throughput
+        else:
+            self.throughput = rate
+            self._has_sample = True
+        self._sampled_completed = self._completed
+        self._sampled_at = now
+
+    def seconds_left(self) -> float:
+        return max(0.0, (self.end_time - datetime.datetime.now()).total_seconds())
+
+    def projected_finish_at(self) -> Optional[datetime.datetime]:
+        """
+        Returns when the remaining messages will be completed at current throughput, None if nothing is being sent
+
+        :return: Optional[datetime.datetime]
+        """
+
+        if self.remaining <= 0:
+            return datetime.datetime.now()
+        if self.throughput <= 0:
+            return None
+        return datetime.datetime.now() + datetime.timedelta(seconds=self.remaining / self.throughput)
+
+    def projected_undelivered(self) -> int:
+        """
+        Returns how many messages won't be delivered: those that failed for good
+        and those that won't be sent before end_time at current throughput
+
+        :return: int
+        """
+
+        return self.failed + max(0, math.ceil(self.remaining - self.throughput * self.seconds_left()))
+
+    def required_throughput(self) -> float:
+        """
+        Returns throughput needed to complete the remaining messages before end_time
+
+        :return: float
+        """
+
+        seconds_left = self.seconds_left()
+        if seconds_left <= 0:
+            return math.inf
+        return max(0, self.remaining) / seconds_left
+
+    def to_pd(self) -> MailingProgress:
+        return MailingProgress(
+            id=self.mailing_id,
+            remaining=max(0, self.remaining),
+            delivered=self.delivered,
+            failed=self.failed,
+            throughput=self.throughput,
+            projected_finish_at=self.projected_finish_at(),
+            projected_undelivered=self.projected_undelivered(),
+        )
@@ -0,0 +1,86 @@
+import asyncio
+import time
+from typing import Dict, Optional
+
+from src.core.config import settings
+
+
+class TokenBucket:
+    """
+    Allows rate acquisitions per second on average with bursts of up to capacity
+
+    Waiters are served in FIFO order
+    """
+
+    def __init__(self, rate: float, capacity: float = 1):
+        self.rate = rate
+        self.capacity = max(capacity, 1)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock: Optional[asyncio.Lock] = None
+
+    async def acquire(self) -> None:
+        """
+        Takes a token, waits for it if the bucket is empty
+
+        :return: None
+        """
+
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while not self.try_acquire():
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def try_acquire(self) -> bool:
+        """
+        Takes a token if there is one, doesn't wait
+
+        :return: bool
+        """
+
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+
+class ProviderRateLimiter:
+    """
+    Token buckets per provider code shared by all mailings of the process
+
+    Providers without a configured rate use default_rate, or aren't limited if it's None.
+    Buckets hold burst tokens, so after an idle period a provider gets at most burst messages at once
+    rather than a second worth of its rate on top of the rate itself
+    """
+
+    def __init__(self, rates: Dict[str, float], default_rate: Optional[float], burst: int):
+        self.rates = rates
+        self.default_rate = default_rate
+        self.burst = burst
+        self._buckets: Dict[str, Optional[TokenBucket]] = {}
+
+    async def acquire(self, provider_code: str) -> None:
+        """
+        Waits until a message to given provider may be sent
+
+        :param provider_code: str
+        :return: None
+        """
+
+        if provider_code not in self._buckets:
+            rate = self.rates.get(provider_code, self.default_rate)
+            self._buckets[provider_code] = TokenBucket(rate=rate, capacity=self.burst) if rate else None
+        bucket = self._buckets[provider_code]
+        if bucket is not None:
+            await bucket.acquire()
+
+
+provider_limiter = ProviderRateLimiter(
+    rates=settings.PROVIDER_RATE_LIMITS,
+    default_rate=settings.PROVIDER_DEFAULT_RATE_LIMIT,
+    burst=settings.PROVIDER_RATE_BURST,
+)
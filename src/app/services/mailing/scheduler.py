@@ -0,0 +1,121 @@
+import asyncio
+import datetime
+import heapq
+import itertools
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+OnDue = Callable[[], Awaitable[None]]
+
+
+class MailingScheduler:
+    """
+    Wakes up when mailings are due
+
+    Start times of mailings known to this process are kept in a min-heap and a single task sleeps
+    until the earliest one, but no longer than poll_interval, so that mailings created by other
+    processes or left behind by crashed ones are picked up too. On every wake-up on_due is called,
+    which claims whatever is due from the database.
+
+    Rescheduling or cancelling a mailing invalidates its heap entry instead of removing it,
+    stale entries are dropped when they reach the top of the heap
+    """
+
+    def __init__(self, on_due: OnDue, poll_interval: float):
+        self.on_due = on_due
+        self.poll_interval = poll_interval
+        self.logger = logging.getLogger(__name__)
+        self._heap: List[Tuple[datetime.datetime, int, int]] = []
+        self._entries: Dict[int, int] = {}
+        self._counter = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def schedule(self, mailing_id: int, start_time: datetime.datetime) -> None:
+        """
+        Schedules mailing start, replaces previously scheduled start of the same mailing
+
+        :param mailing_id: int
+        :param start_time: datetime.datetime
+        :return: None
+        """
+
+        entry = next(self._counter)
+        self._entries[mailing_id] = entry
+        heapq.heappush(self._heap, (start_time, entry, mailing_id))
+        self._wake()
+
+    def cancel(self, mailing_id: int) -> None:
+        """
+        Cancels scheduled mailing start if there is one
+
+        :param mailing_id: int
+        :return: None
+        """
+
+        if self._entries.pop(mailing_id, None) is not None:
+            self._wake()
+
+    async def start(self) -> None:
+        """
+        Starts the scheduler task
+
+        :return: None
+        """
+
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """
+        Stops the scheduler task, scheduled mailings are kept
+
+        :return: None
+        """
+
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self) -> None:
+        next_poll = datetime.datetime.now()
+        while True:
+            self._wakeup.clear()
+            self._drop_stale()
+            now = datetime.datetime.now()
+
+            due = False
+            while self._heap and self._heap[0][0] <= now:
+                _, _, mailing_id = heapq.heappop(self._heap)
+                del self._entries[mailing_id]
+                self.logger.warning(f"Mailing {mailing_id} is due")
+                due = True
+                self._drop_stale()
+
+            if due or now >= next_poll:
+                next_poll = now + datetime.timedelta(seconds=self.poll_interval)
+                try:
+                    await self.on_due()
+                except Exception as e:
+                    self.logger.warning(f"Failed to start due mailings: {e!r}")
+                continue
+
+            wake_at = min(self._heap[0][0], next_poll) if self._heap else next_poll
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=(wake_at - now).total_seconds())
+            except asyncio.TimeoutError:
+                pass
+
+    def _wake(self) -> None:
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _drop_stale(self) -> None:
+        while self._heap:
+            _, entry, mailing_id = self._heap[0]
+            if self._entries.get(mailing_id) == entry:
+                return
+            heapq.heappop(self._heap)
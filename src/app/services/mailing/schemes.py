@@ -1,31 +1,81 @@
 import datetime
-from typing import List
+import enum
+from typing import List, Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, validator, root_validator
 
 from src.app.services.message.schemes import MessageFull
+from src.core.config import settings
+
+
+class MailingState(enum.Enum):
+    scheduled = "scheduled"
+    running = "running"
+    paused = "paused"
+    canceled = "canceled"
+    finished = "finished"
+
+
+class FilterMode(enum.Enum):
+    exact = "exact"
+    substring = "substring"
 
 
 class MailingBase(BaseModel):
     mail_text: str
     user_filter: str
+    filter_mode: FilterMode = FilterMode.exact
     start_time: datetime.datetime
     end_time: datetime.datetime
+    concurrency: int = 1
+    rate_limit: Optional[float] = None
+    priority: int = 1
+    window_start: Optional[datetime.time] = None
+    window_end: Optional[datetime.time] = None
+
+    @validator("concurrency")
+    def check_concurrency(cls, v: Optional[int]) -> Optional[int]:
+        if v is not None and not 1 <= v <= settings.MAILER_MAX_CONCURRENCY:
+            raise ValueError(f"concurrency must be between 1 and {settings.MAILER_MAX_CONCURRENCY}")
+        return v
+
+    @validator("priority")
+    def check_priority(cls, v: Optional[int]) -> Optional[int]:
+        if v is not None and not 1 <= v <= settings.MAILING_MAX_PRIORITY:
+            raise ValueError(f"priority must be between 1 and {settings.MAILING_MAX_PRIORITY}")
+        return v
+
+    @validator("rate_limit")
+    def check_rate_limit(cls, v: Optional[float]) -> Optional[float]:
+        if v is not None and v <= 0:
+            raise ValueError("rate_limit must be positive")
+        return v
 
 
 class Mailing(MailingBase):
     id: int
+    state: MailingState = MailingState.scheduled
+    projected_finish_at: Optional[datetime.datetime] = None
+    projected_undelivered: Optional[int] = None
+    resume_after_id: Optional[int] = None
 
 
 class MailingCreate(MailingBase):
-    ...
+    @root_validator(skip_on_failure=True)
+    def check_window(cls, values: dict) -> dict:
+        if (values.get("window_start") is None) != (values.get("window_end") is None):
+            raise ValueError("window_start and window_end must be given together")
+        return values
 
 
 class MailingUpdate(MailingBase):
     mail_text: str = None
     user_filter: str = None
+    filter_mode: FilterMode = None
     start_time: datetime.datetime = None
     end_time: datetime.datetime = None
+    concurrency: int = None
+    priority: int = None
 
 
 class MailingUpdatedResponse(BaseModel):
@@ -35,6 +85,9 @@ class MailingUpdatedResponse(BaseModel):
 class Stats(BaseModel):
     failed: int
     delivered: int
+    pending: int
+    rejected: int = 0
+    attempts: int = 0
 
 
 class MailingStats(Mailing):
@@ -43,7 +96,31 @@ class MailingStats(Mailing):
 
 class MailingMessages(Mailing):
     messages: List[MessageFull]
+    next_cursor: Optional[int] = None
 
 
 class MailingDeletedResponse(BaseModel):
     id: int
+
+
+class MailingProgress(BaseModel):
+    id: int
+    state: MailingState = MailingState.running
+    remaining: int
+    delivered: int
+    failed: int
+    throughput: float
+    projected_finish_at: Optional[datetime.datetime]
+    projected_undelivered: int
+    queued: int = 0
+    retrying: int = 0
+    in_flight: int = 0
+    workers: int = 0
+
+
+class DispatcherStatus(BaseModel):
+    in_flight: int
+    waiting: int
+    limit: int
+    max_in_flight: int
+    min_rtt: Optional[float]
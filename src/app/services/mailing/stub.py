@@ -0,0 +1,80 @@
+import asyncio
+import logging
+import random
+from typing import List, Optional
+
+from aiohttp import web
+
+from src.app.services.mailing.ratelimit import TokenBucket
+from src.core.config import settings
+
+
+class StubGateway:
+    """
+    Imitates the upstream gateway for capacity testing
+
+    Every request takes latency seconds on average, each message fails with 500 with probability error_rate,
+    and messages above rate_limit per second are throttled with 429
+    """
+
+    def __init__(self, latency: float, error_rate: float, rate_limit: Optional[float]):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.bucket = TokenBucket(rate=rate_limit, capacity=rate_limit) if rate_limit else None
+
+    async def respond(self, count: int) -> List[int]:
+        """
+        Waits for the imitated latency and returns status codes of count messages
+
+        :param count: int
+        :return: List[int]
+        """
+
+        if self.latency > 0:
+            await asyncio.sleep(random.uniform(0.5, 1.5) * self.latency)
+        return [self.status() for _ in range(count)]
+
+    def status(self) -> int:
+        if self.bucket is not None and not self.bucket.try_acquire():
+            return 429
+        if random.random() < self.error_rate:
+            return 500
+        return 200
+
+    def app(self) -> web.Application:
+        """
+        Returns aiohttp application serving the per-message POST /{message_id} and the batch POST / endpoints
+
+        :return: web.Application
+        """
+
+        async def send(request: web.Request) -> web.Response:
+            await request.read()
+            status, = await self.respond(1)
+            return web.json_response({"code": 0, "message": "OK"}, status=status)
+
+        async def send_batch(request: web.Request) -> web.Response:
+            data = await request.json()
+            messages = data.get("messages", [])
+            statuses = await self.respond(len(messages))
+            results = [{"id": m.get("id"), "status": status} for m, status in zip(messages, statuses)]
+            return web.json_response({"results": results})
+
+        app = web.Application()
+        app.router.add_post("/", send_batch)
+        app.router.add_post("/{message_id}", send)
+        return app
+
+
+def get_stub_gateway() -> StubGateway:
+    return StubGateway(
+        latency=settings.STUB_LATENCY,
+        error_rate=settings.STUB_ERROR_RATE,
+        rate_limit=settings.STUB_RATE_LIMIT,
+    )
+
+
+if __name__ == "__main__":
+    # python -m src.app.services.mailing.stub, then point URL_BASE (or SEND_BATCH_URL) at it
+    logging.basicConfig(level=logging.INFO)
+    web.run_app(get_stub_gateway().app(), host="127.0.0.1", port=settings.STUB_PORT)
@@ -0,0 +1,141 @@
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+from typing import List, Optional
+
+import aiohttp
+
+from src.app.services.mailing.stub import StubGateway, get_stub_gateway
+from src.app.services.message.schemes import QueuedMessage
+from src.core.config import settings
+from src.core.http import http_client
+
+
+class Transport(ABC):
+    """
+    Sends messages to the upstream gateway
+
+    send() takes up to batch_size messages sharing the same text and returns the status code
+    of every message in the same order, None if no response was received for it.
+    To plug in another gateway subclass it and return it from get_transport()
+    """
+
+    batch_size = 1
+
+    def __init__(self):
+        self.headers = {"Authorization": f"Bearer {settings.AUTH_TOKEN}"}
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    @abstractmethod
+    async def send(self, messages: List[QueuedMessage], text: str) -> List[Optional[int]]:
+        ...
+
+
+class MessageTransport(Transport):
+    """
+    Sends every message with its own POST {URL_BASE}/{message_id}
+    """
+
+    async def send(self, messages: List[QueuedMessage], text: str) -> List[Optional[int]]:
+        return [await self.send_one(message, text) for message in messages]
+
+    async def send_one(self, message: QueuedMessage, text: str) -> Optional[int]:
+        data = {
+            "id": message.id,
+            "phone": message.phone,
+            "text": text,
+        }
+        url = f"{settings.URL_BASE}/{message.id}"
+        try:
+            async with http_client.session.post(url=url, json=data, headers=self.headers) as resp:
+                status_code = resp.status
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.logger.warning(f"{url}   {e!r}   {data}")
+            return None
+        self.logger.warning(f"{url}   {status_code}   {data}")
+        return status_code
+
+
+class BatchTransport(Transport):
+    """
+    Sends up to batch_size messages with one POST {SEND_BATCH_URL}
+
+    Request body is {"text": ..., "messages": [{"id": ..., "phone": ...}, ...]}, a 200 response
+    is expected to carry {"results": [{"id": ..., "status": ...}, ...]} with an HTTP-like status per message,
+    messages missing from results get None.
+    A batch refused as malformed or too large (400, 413, 422) is split in halves that are sent again,
+    so that only the messages at fault are rejected. Other statuses of the request are given to every message,
+    they are about the request rather than the messages
+    """
+
+    split_statuses = (400, 413, 422)
+
+    def __init__(self, batch_size: int, url: str):
+        super().__init__()
+        self.batch_size = batch_size
+        self.url = url
+
+    async def send(self, messages: List[QueuedMessage], text: str) -> List[Optional[int]]:
+        data = {
+            "text": text,
+            "messages": [{"id": message.id, "phone": message.phone} for message in messages],
+        }
+        ids = [message.id for message in messages]
+        try:
+            async with http_client.session.post(url=self.url, json=data, headers=self.headers) as resp:
+                status_code = resp.status
+                body = await resp.json(content_type=None) if status_code == 200 else None
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            self.logger.warning(f"{self.url}   {e!r}   {ids}")
+            return [None] * len(messages)
+        self.logger.warning(f"{self.url}   {status_code}   {ids}")
+        if status_code in self.split_statuses:
+            if len(messages) > 1:
+                middle = len(messages) // 2
+                return await self.send(messages[:middle], text) + await self.send(messages[middle:], text)
+            # 413 on a single message is a gateway limit rather than a judgement of the message
+            return [None if status_code == 413 else status_code]
+        if status_code != 200:
+            return [status_code] * len(messages)
+
+        results = {}
+        for item in (body or {}).get("results", []):
+            try:
+                results[int(item["id"])] = int(item["status"])
+            except (KeyError, TypeError, ValueError):
+                continue
+        return [results.get(message.id) for message in messages]
+
+
+class StubTransport(Transport):
+    """
+    Sends nothing, gets status codes from an in-process stub gateway
+
+    Used in dry-run mode to measure the pipeline and the database load without a live gateway
+    """
+
+    def __init__(self, gateway: StubGateway, batch_size: int):
+        super().__init__()
+        self.gateway = gateway
+        self.batch_size = batch_size
+
+    async def send(self, messages: List[QueuedMessage], text: str) -> List[Optional[int]]:
+        return await self.gateway.respond(len(messages))
+
+
+def get_transport() -> Transport:
+    """
+    Returns the stub transport in dry-run mode, otherwise the transport chosen by SEND_BATCH_SIZE,
+    messages are sent one by one unless it's above 1
+
+    :return: Transport
+    """
+
+    if settings.DRY_RUN:
+        return StubTransport(gateway=get_stub_gateway(), batch_size=max(1, settings.SEND_BATCH_SIZE))
+    if settings.SEND_BATCH_SIZE > 1:
+        return BatchTransport(batch_size=settings.SEND_BATCH_SIZE, url=settings.SEND_BATCH_URL or settings.URL_BASE)
+    return MessageTransport()
+
+
+transport = get_transport()
@@ -0,0 +1,93 @@
+import datetime
+import functools
+import re
+import zoneinfo
+from typing import Optional
+
+OFFSET_RE = re.compile(r"^(?:UTC|GMT)?\s*([+-])(\d{1,2})(?::?(\d{2}))?$", re.IGNORECASE)
+
+
+@functools.lru_cache(maxsize=None)
+def parse_time_zone(value: Optional[str]) -> Optional[datetime.tzinfo]:
+    """
+    Parses IANA time zone names (Europe/Moscow) and UTC offsets (UTC+3, +03:00, GMT-5), None if it can't
+
+    :param value: Optional[str]
+    :return: Optional[datetime.tzinfo]
+    """
+
+    if not value:
+        return None
+    value = value.strip()
+    if value.upper() in ("UTC", "GMT", "Z"):
+        return datetime.timezone.utc
+    match = OFFSET_RE.match(value)
+    if match:
+        sign, hours, minutes = match.groups()
+        offset = datetime.timedelta(hours=int(hours), minutes=int(minutes or 0))
+        if offset >= datetime.timedelta(hours=24):
+            return None
+        return datetime.timezone(-offset if sign == "-" else offset)
+    try:
+        return zoneinfo.ZoneInfo(value)
+    except (zoneinfo.ZoneInfoNotFoundError, ValueError):
+        return None
+
+
+class DeliveryWindow:
+    """
+    Daily window of subscriber local time when messages may be delivered, may span midnight
+
+    Methods take and return naive server local datetimes, like the rest of the mailing code.
+    Subscribers with unknown time zones are treated as living in the server time zone
+    """
+
+    def __init__(self, start: datetime.time, end: datetime.time):
+        self.start = start
+        self.end = end
+
+    def contains(self, t: datetime.time) -> bool:
+        if self.start == self.end:
+            return True
+        if self.start < self.end:
+            return self.start <= t < self.end
+        return t >= self.start or t < self.end
+
+    def next_open(self, time_zone: Optional[str], now: datetime.datetime) -> datetime.datetime:
+        """
+        Returns now if the window is open, otherwise when it opens next
+
+        :param time_zone: Optional[str]
+        :param now: datetime.datetime
+        :return: datetime.datetime
+        """
+
+        local = self._local(time_zone, now)
+        if self.contains(local.time()):
+            return now
+        return self._next(local, self.start)
+
+    def closes_at(self, time_zone: Optional[str], now: datetime.datetime) -> datetime.datetime:
+        """
+        Returns when the window closes next
+
+        :param time_zone: Optional[str]
+        :param now: datetime.datetime
+        :return: datetime.datetime
+        """
+
+        if self.start == self.end:
+            return datetime.datetime.max
+        return self._next(self._local(time_zone, now), self.end)
+
+    @staticmethod
+    def _local(time_zone: Optional[str], now: datetime.datetime) -> datetime.datetime:
+        tz = parse_time_zone(time_zone)
+        return now.astimezone(tz) if tz is not None else now.astimezone()
+
+    @staticmethod
+    def _next(local: datetime.datetime, t: datetime.time) -> datetime.datetime:
+        moment = local.replace(hour=t.hour, minute=t.minute, second=t.second, microsecond=0)
+        if moment <= local:
+            moment += datetime.timedelta(days=1)
+        return moment.astimezone().replace(tzinfo=None)
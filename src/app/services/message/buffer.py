@@ -0,0 +1,103 @@
+import asyncio
+import datetime
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from src.app.services.message.models import MessageStatus
+
+Writer = Callable[[List[dict]], Awaitable[None]]
+
+
+class StatusBuffer:
+    """
+    Write-behind buffer for message status transitions
+
+    Transitions are kept in memory (the latest one per message wins) and handed to the writer
+    in batches, either when the buffer reaches flush_size or every flush_interval seconds
+    """
+
+    def __init__(self, writer: Writer, flush_size: int, flush_interval: float):
+        self.writer = writer
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.logger = logging.getLogger(__name__)
+        self._rows: Dict[int, dict] = {}
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    async def add(self, message_id: int, status: MessageStatus, sent_at: datetime.datetime, attempts: int) -> None:
+        """
+        Buffers a status transition, flushes the buffer if it's full
+
+        Flush errors are logged rather than raised, the rows are retried by the next flush
+
+        :param message_id: int
+        :param status: MessageStatus
+        :param sent_at: datetime.datetime
+        :param attempts: int
+        :return: None
+        """
+
+        self._rows[message_id] = {"b_id": message_id, "b_status": status, "b_sent_at": sent_at, "b_attempts": attempts}
+        if len(self._rows) >= self.flush_size:
+            # the rows are kept for the next flush, a failed write mustn't fail the send that triggered it
+            try:
+                await self.flush()
+            except Exception as e:
+                self.logger.warning(f"Message status flush failed: {e!r}")
+
+    async def flush(self) -> None:
+        """
+        Writes all buffered transitions in one batch
+
+        On failure or cancellation the rows are put back so that the next flush retries them
+
+        :return: None
+        """
+
+        if self._flush_lock is None:
+            # created lazily so that it's bound to the running loop rather than the import-time one
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            if not self._rows:
+                return
+            rows, self._rows = self._rows, {}
+            try:
+                await self.writer(list(rows.values()))
+            except BaseException:
+                for message_id, row in rows.items():
+                    self._rows.setdefault(message_id, row)
+                raise
+            self.logger.warning(f"Flushed {len(rows)} message statuses")
+
+    async def start(self) -> None:
+        """
+        Starts periodic flushing
+
+        :return: None
+        """
+
+        self._task = asyncio.create_task(self._flush_periodically())
+
+    async def stop(self) -> None:
+        """
+        Stops periodic flushing and writes whatever is left in the buffer
+
+        :return: None
+        """
+
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+    async def _flush_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                self.logger.warning(f"Message status flush failed: {e!r}")
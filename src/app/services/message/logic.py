@@ -1,61 +1,368 @@
-from sqlalchemy import select, update
+import datetime
+from collections import Counter, defaultdict
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from sqlalchemy import select, update, delete, text, bindparam, cast, literal, literal_column, Integer, and_, func
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql import ColumnElement, Select
 
-from src.app.services.message.models import MessageModel
-from src.app.services.message.schemes import Message, MessageCreate
+from src.app.services.message.buffer import StatusBuffer
+from src.app.services.message.models import MessageModel, MessageStatus, MailingStatsModel
+from src.app.services.message.schemes import QueuedMessage
+from src.app.services.subscriber.models import SubscriberModel
 from src.core.base_crud import CRUDBase
+from src.core.config import settings
+from src.core.database import SessionLocal
+from src.core.metrics import timed
+
+# time_zone argument of get_queued_page meaning messages to subscribers in any time zone, since None is a zone too
+ANY_TIME_ZONE: Any = object()
 
 
 class MessageService(CRUDBase):
     def __init__(self):
         super().__init__(model=MessageModel)
+        self.status_buffer = StatusBuffer(
+            writer=self.write_statuses,
+            flush_size=settings.MESSAGE_FLUSH_SIZE,
+            flush_interval=settings.MESSAGE_FLUSH_INTERVAL,
+        )
 
-    async def update_message(self, message_id: int, obj: Message, db: AsyncSession) -> None:
+    async def buffer_status(
+        self,
+        message_id: int,
+        status: MessageStatus,
+        sent_at: datetime.datetime,
+        attempts: int,
+    ) -> None:
         """
-        Updates existing message by its id
+        Queues message status update, the update is written by the next status buffer flush
 
         :param message_id: int
-        :param obj: Message
-        :param db: AsyncSession
+        :param status: MessageStatus
+        :param sent_at: datetime.datetime
+        :param attempts: int, number of send attempts made so far
+        :return: None
+        """
+
+        await self.status_buffer.add(message_id=message_id, status=status, sent_at=sent_at, attempts=attempts)
+
+    async def flush_statuses(self) -> None:
+        """
+        Writes all buffered status updates to the database
+
+        :return: None
+        """
+
+        await self.status_buffer.flush()
+
+    @staticmethod
+    def count_change(
+        counts: Counter,
+        old_status: Optional[MessageStatus],
+        new_status: MessageStatus,
+        attempts: int = 0,
+    ) -> None:
+        """
+        Adds a message status change to counter deltas of its mailing
+
+        :param counts: Counter of deltas keyed by mailing_stats column name
+        :param old_status: Optional[MessageStatus]
+        :param new_status: MessageStatus
+        :param attempts: int, send attempts made by the change
         :return: None
         """
 
-        data = obj.__dict__
-        valid_data = {k: data[k] for k in data if data[k]}
-        query = update(MessageModel).where(MessageModel.id == message_id).values(**valid_data)
-        await db.execute(query)
-        await db.commit()
+        if old_status is not None:
+            counts[old_status.name] -= 1
+        counts[new_status.name] += 1
+        counts["attempts"] += attempts
+
+    async def add_counts(self, session: AsyncSession, counts: Dict[int, Counter]) -> None:
+        """
+        Adds deltas to mailing_stats counters, the caller commits so that they change together with messages
+
+        :param session: AsyncSession
+        :param counts: Dict[int, Counter], deltas by mailing id
+        :return: None
+        """
+
+        table = MailingStatsModel.__table__
+        columns = ["pending", "delivered", "failed", "rejected", "attempts"]
+        rows = [
+            {"mailing_id": mailing_id, **{column: deltas[column] for column in columns}}
+            for mailing_id, deltas in sorted(counts.items())
+            if any(deltas[column] for column in columns)
+        ]
+        if not rows:
+            return
+        stmt = insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.mailing_id],
+            set_={column: table.c[column] + stmt.excluded[column] for column in columns},
+        )
+        await session.execute(stmt, rows)
+
+    @timed
+    async def reconcile_counts(self, session: AsyncSession, mailing_id: Optional[int] = None) -> int:
+        """
+        Rebuilds mailing_stats counters from messages
+
+        The counters table is locked meanwhile, status writes wait and apply their deltas to the rebuilt counters
+
+        :param session: AsyncSession
+        :param mailing_id: Optional[int], all mailings if None
+        :return: int, number of rebuilt counter rows
+        """
+
+        table = MailingStatsModel.__table__
+        status = self.model.status
+        counts = select(
+            self.model.mailing_id,
+            func.count().filter(status == MessageStatus.pending),
+            func.count().filter(status == MessageStatus.delivered),
+            func.count().filter(status == MessageStatus.failed),
+            func.count().filter(status == MessageStatus.rejected),
+            func.coalesce(func.sum(self.model.attempts), 0),
+        ).where(self.model.mailing_id.isnot(None)).group_by(self.model.mailing_id)
+        clear = delete(table)
+        if mailing_id is not None:
+            counts = counts.where(self.model.mailing_id == mailing_id)
+            clear = clear.where(table.c.mailing_id == mailing_id)
+
+        await session.execute(text(f"LOCK TABLE {table.name} IN EXCLUSIVE MODE"))
+        await session.execute(clear)
+        result = await session.execute(
+            insert(table).from_select(["mailing_id", "pending", "delivered", "failed", "rejected", "attempts"], counts)
+        )
+        await session.commit()
+        return result.rowcount
+
+    @timed
+    async def write_statuses(self, rows: List[dict]) -> None:
+        """
+        Updates status, sent_at and attempts of many messages with one executemany UPDATE and a single commit
+
+        mailing_stats counters are updated in the same transaction by the difference from current statuses
+
+        :param rows: List[dict] with b_id, b_status, b_sent_at and b_attempts keys
+        :return: None
+        """
+
+        current = (
+            select(self.model.id, self.model.mailing_id, self.model.status, self.model.attempts)
+            .where(self.model.id.in_([row["b_id"] for row in rows]))
+            .order_by(self.model.id)
+            .with_for_update()
+        )
+
+        table = self.model.__table__
+        stmt = (
+            update(table)
+            .where(table.c.id == bindparam("b_id"))
+            .values(
+                status=bindparam("b_status", type_=table.c.status.type),
+                sent_at=bindparam("b_sent_at", type_=table.c.sent_at.type),
+                attempts=bindparam("b_attempts", type_=table.c.attempts.type),
+            )
+        )
+        async with SessionLocal() as session:
+            messages = {message.id: message for message in await session.execute(current)}
+            counts = defaultdict(Counter)
+            for row in rows:
+                message = messages.get(row["b_id"])
+                if message is None:
+                    continue
+                self.count_change(
+                    counts[message.mailing_id],
+                    message.status,
+                    row["b_status"],
+                    attempts=row["b_attempts"] - message.attempts,
+                )
+            await session.execute(stmt, rows)
+            await self.add_counts(session=session, counts=counts)
+            await session.commit()
+
+    @timed
+    async def create_pending_messages(self, session: AsyncSession, mailing_id: int, subscriber_ids: Select) -> int:
+        """
+        Creates pending messages of a mailing for all selected subscribers with a single INSERT ... SELECT
+
+        Subscribers that already have a message in the mailing are skipped, so it's safe to call again
+
+        :param session: AsyncSession
+        :param mailing_id: int
+        :param subscriber_ids: Select of subscriber ids
+        :return: int, number of created messages
+        """
+
+        audience = subscriber_ids.subquery()
+        rows = select(
+            cast(literal(mailing_id), Integer),
+            audience.c.id,
+            cast(literal_column(f"'{MessageStatus.pending.name}'"), self.model.status.type),
+        )
+        stmt = (
+            insert(self.model)
+            .from_select(["mailing_id", "subscriber_id", "status"], rows)
+            .on_conflict_do_nothing(index_elements=["mailing_id", "subscriber_id"])
+        )
+        result = await session.execute(stmt)
+        await self.add_counts(session=session, counts={mailing_id: Counter(pending=result.rowcount)})
+        await session.commit()
+        return result.rowcount
+
+    @timed
+    async def delete_undelivered_messages(self, session: AsyncSession, mailing_id: int) -> int:
+        """
+        Deletes pending and failed messages of a mailing, e.g. when its audience changes
+
+        mailing_stats counters are decreased by the deleted messages, the caller commits so that
+        they change together. Delivered and rejected messages are kept
+
+        :param session: AsyncSession
+        :param mailing_id: int
+        :return: int, number of deleted messages
+        """
+
+        stmt = (
+            delete(self.model)
+            .where(
+                self.model.mailing_id == mailing_id,
+                self.model.status.in_([MessageStatus.pending, MessageStatus.failed]),
+            )
+            .returning(self.model.status, self.model.attempts)
+        )
+        result = await session.execute(stmt)
+        counts = Counter()
+        deleted = 0
+        for status, attempts in result:
+            counts[status.name] -= 1
+            counts["attempts"] -= attempts
+            deleted += 1
+        await self.add_counts(session=session, counts={mailing_id: counts})
+        return deleted
 
-    async def add_pending_message(self, message: MessageCreate, db: AsyncSession) -> MessageModel:
+    def queued_filter(self, mailing_id: int) -> ColumnElement:
+        """
+        Returns the where clause that selects undelivered messages of a mailing that have attempts left,
+        messages rejected by the upstream are never selected again
+
+        Statuses are listed rather than excluding delivered, so the clause is served by ix_messages_mailing_id_status
+
+        :param mailing_id: int
+        :return: ColumnElement
         """
-        Adds pending message for given subscriber and mailing
 
-        :param message: MessageCreate
-        :param db: AsyncSession
-        :return: MessageModel
+        return and_(
+            self.model.mailing_id == mailing_id,
+            self.model.status.in_([MessageStatus.pending, MessageStatus.failed]),
+            self.model.attempts < settings.MESSAGE_MAX_ATTEMPTS,
+        )
+
+    @timed
+    async def count_queued(self, mailing_id: int) -> int:
+        """
+        Returns number of undelivered messages of a mailing that have attempts left
+
+        :param mailing_id: int
+        :return: int
+        """
+
+        stmt = select(func.count()).select_from(self.model).where(self.queued_filter(mailing_id))
+        async with SessionLocal() as session:
+            coro = await session.execute(stmt)
+            return coro.scalar_one()
+
+    @timed
+    async def get_queued_page(
+        self,
+        mailing_id: int,
+        after_id: int,
+        limit: int,
+        time_zone: Optional[str] = ANY_TIME_ZONE,
+    ) -> List[QueuedMessage]:
+        """
+        Returns a page of queued messages of a mailing along with their recipients, ordered by message id
+
+        :param mailing_id: int
+        :param after_id: int, id of the last message of the previous page
+        :param limit: int
+        :param time_zone: Optional[str], only messages to subscribers in this time zone,
+            None selects subscribers without one
+        :return: List[QueuedMessage]
+        """
+
+        stmt = (
+            select(
+                self.model.id,
+                self.model.subscriber_id,
+                SubscriberModel.phone,
+                SubscriberModel.provider_code,
+                SubscriberModel.time_zone,
+                self.model.attempts,
+            )
+            .join(SubscriberModel, SubscriberModel.id == self.model.subscriber_id)
+            .where(self.queued_filter(mailing_id), self.model.id > after_id)
+            .order_by(self.model.id)
+            .limit(limit)
+        )
+        if time_zone is None:
+            stmt = stmt.where(SubscriberModel.time_zone.is_(None))
+        elif time_zone is not ANY_TIME_ZONE:
+            stmt = stmt.where(SubscriberModel.time_zone == time_zone)
+        async with SessionLocal() as session:
+            coro = await session.execute(stmt)
+            return [QueuedMessage(**row) for row in coro.mappings()]
+
+    async def iter_queued_messages(
+        self,
+        mailing_id: int,
+        page_size: int,
+        after_id: int = 0,
+    ) -> AsyncIterator[List[QueuedMessage]]:
+        """
+        Yields queued messages of a mailing along with their recipients page by page
+
+        Pages are fetched with keyset pagination on message id, each one in a short-lived session,
+        so no connection is held between pages
+
+        :param mailing_id: int
+        :param page_size: int
+        :param after_id: int, only messages with greater ids are yielded
+        :return: AsyncIterator[List[QueuedMessage]]
         """
 
-        obj_in_data = message.dict()
-        db_obj = self.model(**obj_in_data)
-        db.add(db_obj)
-        await db.commit()
-        await db.refresh(db_obj)
-        return db_obj
+        last_id = after_id
+        while True:
+            page = await self.get_queued_page(mailing_id=mailing_id, after_id=last_id, limit=page_size)
+            if not page:
+                return
+            yield page
+            if len(page) < page_size:
+                return
+            last_id = page[-1].id
 
-    async def get_by_subscriber_mailing(self, subscriber_id: int, mailing_id: int, db: AsyncSession) -> MessageModel:
+    @timed
+    async def get_queued_time_zones(self, mailing_id: int) -> List[Optional[str]]:
         """
-        Returns message from database by subscriber.id and mailing.id
+        Returns distinct time zones of subscribers that have queued messages in a mailing,
+        None stands for subscribers without one
 
-        :param subscriber_id: int
         :param mailing_id: int
-        :param db: AsyncSession
-        :return: MessageModel
+        :return: List[Optional[str]]
         """
 
-        stmt = select(self.model).where(self.model.subscriber_id == subscriber_id, self.model.mailing_id == mailing_id)
-        coro = await db.execute(stmt)
-        db_obj = coro.scalar()
-        return db_obj
+        stmt = (
+            select(SubscriberModel.time_zone)
+            .join(self.model, SubscriberModel.id == self.model.subscriber_id)
+            .where(self.queued_filter(mailing_id))
+            .distinct()
+        )
+        async with SessionLocal() as session:
+            coro = await session.execute(stmt)
+            return list(coro.scalars())
 
 
 message_service = MessageService()
@@ -1,6 +1,6 @@
 import enum
 
-from sqlalchemy import Column, Integer, DateTime, Enum, ForeignKey
+from sqlalchemy import Column, Integer, DateTime, Enum, ForeignKey, UniqueConstraint, Index
 from sqlalchemy.sql import func
 
 from src.core.database import Base
@@ -10,16 +10,37 @@ class MessageStatus(enum.Enum):
     delivered = "delivered"
     failed = "failed"
     pending = "pending"
+    rejected = "rejected"
 
 
 class MessageModel(Base):
     __tablename__ = "messages"
+    __table_args__ = (
+        UniqueConstraint("mailing_id", "subscriber_id", name="uq_messages_mailing_subscriber"),
+        Index("ix_messages_mailing_id_id", "mailing_id", "id"),
+        Index("ix_messages_mailing_id_status", "mailing_id", "status"),
+    )
     id = Column(Integer, primary_key=True)
     sent_at = Column(DateTime, server_default=func.now())
     status = Column(Enum(MessageStatus))
+    attempts = Column(Integer, nullable=False, server_default="0")
     mailing_id = Column(Integer, ForeignKey("mailings.id"))
     subscriber_id = Column(Integer, ForeignKey("subscribers.id"))
 
     def to_pd(self):
         from src.app.services.message.schemes import MessageFull
         return MessageFull(**self.__dict__)
+
+
+class MailingStatsModel(Base):
+    """
+    Message counters of a mailing, kept up to date by message_service in the same transaction as message changes
+    """
+
+    __tablename__ = "mailing_stats"
+    mailing_id = Column(Integer, ForeignKey("mailings.id", ondelete="CASCADE"), primary_key=True)
+    pending = Column(Integer, nullable=False, server_default="0")
+    delivered = Column(Integer, nullable=False, server_default="0")
+    failed = Column(Integer, nullable=False, server_default="0")
+    rejected = Column(Integer, nullable=False, server_default="0")
+    attempts = Column(Integer, nullable=False, server_default="0")
@@ -0,0 +1,21 @@
+import argparse
+import asyncio
+import logging
+from typing import Optional
+
+from src.app.services.message.logic import message_service
+from src.core.database import SessionLocal
+
+
+async def reconcile(mailing_id: Optional[int] = None) -> None:
+    async with SessionLocal() as session:
+        rebuilt = await message_service.reconcile_counts(session=session, mailing_id=mailing_id)
+    logging.getLogger(__name__).warning(f"Rebuilt message counters of {rebuilt} mailings")
+
+
+if __name__ == "__main__":
+    # python -m src.app.services.message.reconcile [--mailing-id ID]
+    parser = argparse.ArgumentParser(description="Rebuilds mailing_stats counters from messages")
+    parser.add_argument("--mailing-id", type=int, default=None, help="only this mailing")
+    args = parser.parse_args()
+    asyncio.run(reconcile(mailing_id=args.mailing_id))
@@ -1,4 +1,5 @@
 import datetime
+from typing import Optional
 
 from pydantic import BaseModel
 
@@ -17,4 +18,13 @@ class MessageCreate(Message):
 
 
 class MessageFull(MessageCreate):
-    ...
+    attempts: int = 0
+
+
+class QueuedMessage(BaseModel):
+    id: int
+    subscriber_id: int
+    phone: int
+    provider_code: str
+    time_zone: Optional[str]
+    attempts: int
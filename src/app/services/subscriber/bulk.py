@@ -0,0 +1,137 @@
+import codecs
+import csv
+import enum
+import io
+import json
+import zlib
+from typing import AsyncIterator, List, Mapping, Optional, Sequence, Tuple
+
+Record = Tuple[int, str, str, str]
+
+COLUMNS = ("phone", "provider_code", "tag", "time_zone")
+EXPORT_COLUMNS = ("id",) + COLUMNS
+# subscribers.phone is a bigint, larger values would fail the whole COPY
+PHONE_MAX = 2 ** 63 - 1
+
+
+class BulkFormat(enum.Enum):
+    csv = "csv"
+    ndjson = "ndjson"
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """
+    Splits a stream of utf-8 encoded chunks into lines without reading the whole stream
+
+    :param chunks: AsyncIterator[bytes]
+    :return: AsyncIterator[str]
+    """
+
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    tail = ""
+    async for chunk in chunks:
+        lines = (tail + decoder.decode(chunk)).split("\n")
+        tail = lines.pop()
+        for line in lines:
+            yield line
+    tail += decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+def to_record(values: Sequence) -> Optional[Record]:
+    """
+    Validates subscriber fields in COLUMNS order, returns None if they are invalid
+
+    :param values: Sequence
+    :return: Optional[Record]
+    """
+
+    if len(values) != len(COLUMNS) or any(v is None or v == "" for v in values):
+        return None
+    phone, provider_code, tag, time_zone = values
+    if isinstance(phone, bool):
+        return None
+    try:
+        phone = int(phone)
+    except (TypeError, ValueError):
+        return None
+    if not 0 < phone <= PHONE_MAX:
+        return None
+    return phone, str(provider_code), str(tag), str(time_zone)
+
+
+async def read_records(chunks: AsyncIterator[bytes], fmt: BulkFormat) -> AsyncIterator[Optional[Record]]:
+    """
+    Parses subscribers from CSV with a header row or from NDJSON, yields None for every rejected row
+
+    CSV fields may be quoted but can't contain line breaks
+
+    :param chunks: AsyncIterator[bytes]
+    :param fmt: BulkFormat
+    :return: AsyncIterator[Optional[Record]]
+    """
+
+    header = None
+    async for line in iter_lines(chunks):
+        line = line.rstrip("\r")
+        if not line.strip():
+            continue
+
+        if fmt == BulkFormat.ndjson:
+            try:
+                obj = json.loads(line)
+            except ValueError:
+                yield None
+                continue
+            yield to_record([obj.get(c) for c in COLUMNS]) if isinstance(obj, dict) else None
+            continue
+
+        row = next(csv.reader([line]))
+        if header is None:
+            header = [c.strip() for c in row]
+            continue
+        if len(row) != len(header):
+            yield None
+            continue
+        obj = dict(zip(header, row))
+        yield to_record([obj.get(c) for c in COLUMNS])
+
+
+async def write_records(pages: AsyncIterator[List[Mapping]], fmt: BulkFormat) -> AsyncIterator[bytes]:
+    """
+    Serializes pages of subscriber rows to CSV with a header row or to NDJSON, one chunk per page
+
+    :param pages: AsyncIterator[List[Mapping]]
+    :param fmt: BulkFormat
+    :return: AsyncIterator[bytes]
+    """
+
+    if fmt == BulkFormat.csv:
+        yield (",".join(EXPORT_COLUMNS) + "\n").encode()
+    async for page in pages:
+        buf = io.StringIO()
+        if fmt == BulkFormat.csv:
+            writer = csv.writer(buf, lineterminator="\n")
+            writer.writerows([row[c] for c in EXPORT_COLUMNS] for row in page)
+        else:
+            for row in page:
+                buf.write(json.dumps({c: row[c] for c in EXPORT_COLUMNS}))
+                buf.write("\n")
+        yield buf.getvalue().encode()
+
+
+async def gzip_chunks(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """
+    Compresses a stream of chunks into a gzip stream
+
+    :param chunks: AsyncIterator[bytes]
+    :return: AsyncIterator[bytes]
+    """
+
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    async for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
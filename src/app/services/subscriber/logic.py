@@ -1,18 +1,23 @@
-from typing import List
+from typing import AsyncIterator, List, Mapping, Optional
 
-from sqlalchemy import select, or_
+from sqlalchemy import select, or_, text
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql import ColumnElement, Select
 
-from src.app.services.mailing.schemes import Mailing
+from src.app.services.mailing.schemes import Mailing, FilterMode
 from src.app.services.subscriber.models import SubscriberModel
-from src.app.services.subscriber.schemes import SubscriberCreate, Subscriber
+from src.app.services.subscriber.bulk import COLUMNS, EXPORT_COLUMNS, Record
+from src.app.services.subscriber.schemes import SubscriberCreate, Subscriber, SubscriberPage, SubscriberImportResult
 from src.core.base_crud import CRUDBase
+from src.core.config import settings
+from src.core.metrics import timed
 
 
 class SubscriberService(CRUDBase):
     def __init__(self):
         super().__init__(model=SubscriberModel)
 
+    @timed
     async def create_subscriber(self, session: AsyncSession, obj_in: SubscriberCreate) -> Subscriber:
         """
         Adds new subscriber to the database
@@ -25,6 +30,7 @@ class SubscriberService(CRUDBase):
         subscriber_model = await self.save(session=session, obj_in=obj_in)
         return subscriber_model
 
+    @timed
     async def get_by_phone(self, session: AsyncSession, phone: int) -> SubscriberModel:
         """
         Returns subscriber by phone
@@ -39,20 +45,136 @@ class SubscriberService(CRUDBase):
         db_obj = coro.scalar()
         return db_obj
 
-    async def get_mailing_subscribers(self, session: AsyncSession, mailing: Mailing) -> List[Subscriber]:
+    @timed
+    async def get_subscribers_page(
+        self,
+        session: AsyncSession,
+        cursor: Optional[int],
+        limit: int,
+        tag: Optional[str] = None,
+        provider_code: Optional[str] = None,
+    ) -> SubscriberPage:
         """
-        Returns subscribers that belong to given mailing
+        Returns a page of subscribers, optionally with given tag and provider code
 
         :param session: AsyncSession
-        :param mailing:
-        :return: List[Subscriber]
+        :param cursor: Optional[int]
+        :param limit: int
+        :param tag: Optional[str]
+        :param provider_code: Optional[str]
+        :return: SubscriberPage
+        """
+
+        filters = []
+        if tag is not None:
+            filters.append(self.model.tag == tag)
+        if provider_code is not None:
+            filters.append(self.model.provider_code == provider_code)
+        models, next_cursor = await self.get_page(session=session, cursor=cursor, limit=limit, filters=filters)
+        return SubscriberPage(items=[m.to_pd() for m in models], next_cursor=next_cursor)
+
+    def audience_filter(self, mailing: Mailing) -> ColumnElement:
+        """
+        Returns the where clause that selects subscribers of given mailing
+
+        Exact mode matches tag or provider code equal to the filter using B-tree indexes,
+        substring mode matches them containing the filter using trigram indexes
+
+        :param mailing: Mailing
+        :return: ColumnElement
         """
 
         f = mailing.user_filter
-        stmt = select(self.model).filter(or_(self.model.tag.ilike(f"%{f}%"), self.model.provider_code.ilike(f"%{f}%")))
-        coro = await session.execute(stmt)
-        db_obj = coro.scalars().all()
-        return [o.to_pd() for o in db_obj if o]
+        if mailing.filter_mode == FilterMode.exact:
+            return or_(self.model.tag == f, self.model.provider_code == f)
+        return or_(self.model.tag.ilike(f"%{f}%"), self.model.provider_code.ilike(f"%{f}%"))
+
+    def audience_ids(self, mailing: Mailing) -> Select:
+        """
+        Returns a select of ids of subscribers that belong to given mailing
+
+        :param mailing: Mailing
+        :return: Select
+        """
+
+        return select(self.model.id).where(self.audience_filter(mailing))
+
+    @timed
+    async def import_subscribers(
+        self,
+        session: AsyncSession,
+        records: AsyncIterator[Optional[Record]],
+    ) -> SubscriberImportResult:
+        """
+        Loads subscribers into a temporary staging table with COPY, then upserts them by phone in one statement
+
+        Records are copied in batches of SUBSCRIBER_IMPORT_BATCH, None records are counted as rejected.
+        If a phone occurs several times, the last record wins and the others are counted as rejected
+
+        :param session: AsyncSession
+        :param records: AsyncIterator[Optional[Record]]
+        :return: SubscriberImportResult
+        """
+
+        conn = await session.connection()
+        await conn.execute(text(
+            "CREATE TEMPORARY TABLE subscribers_import ("
+            "ord bigserial, phone bigint, provider_code varchar, tag varchar, time_zone varchar"
+            ") ON COMMIT DROP"
+        ))
+        driver_conn = (await conn.get_raw_connection()).driver_connection
+
+        rejected = 0
+        staged = 0
+        batch = []
+        async for record in records:
+            if record is None:
+                rejected += 1
+                continue
+            staged += 1
+            batch.append(record)
+            if len(batch) >= settings.SUBSCRIBER_IMPORT_BATCH:
+                await driver_conn.copy_records_to_table("subscribers_import", records=batch, columns=COLUMNS)
+                batch = []
+        if batch:
+            await driver_conn.copy_records_to_table("subscribers_import", records=batch, columns=COLUMNS)
+
+        coro = await conn.execute(text(
+            "WITH upserted AS ("
+            " INSERT INTO subscribers (phone, provider_code, tag, time_zone)"
+            " SELECT DISTINCT ON (phone) phone, provider_code, tag, time_zone"
+            " FROM subscribers_import ORDER BY phone, ord DESC"
+            " ON CONFLICT (phone) DO UPDATE SET"
+            " provider_code = EXCLUDED.provider_code, tag = EXCLUDED.tag, time_zone = EXCLUDED.time_zone"
+            " RETURNING (xmax = 0) AS inserted"
+            ")"
+            " SELECT count(*) FILTER (WHERE inserted), count(*) FILTER (WHERE NOT inserted) FROM upserted"
+        ))
+        inserted, updated = coro.one()
+        rejected += staged - inserted - updated
+        await session.commit()
+        self.logger.warning(f"Imported subscribers: {inserted} inserted, {updated} updated, {rejected} rejected")
+        return SubscriberImportResult(inserted=inserted, updated=updated, rejected=rejected)
+
+    async def stream_subscribers(
+        self,
+        session: AsyncSession,
+        mailing: Optional[Mailing] = None,
+    ) -> AsyncIterator[List[Mapping]]:
+        """
+        Yields pages of subscriber rows read through a server-side cursor, optionally only the mailing audience
+
+        :param session: AsyncSession
+        :param mailing: Optional[Mailing]
+        :return: AsyncIterator[List[Mapping]]
+        """
+
+        stmt = select(*[getattr(self.model, c) for c in EXPORT_COLUMNS]).order_by(self.model.id)
+        if mailing is not None:
+            stmt = stmt.where(self.audience_filter(mailing))
+        result = await session.stream(stmt)
+        async for page in result.mappings().partitions(settings.SUBSCRIBER_EXPORT_BATCH):
+            yield page
 
 
 subscriber_service = SubscriberService()
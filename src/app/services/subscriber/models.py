@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, BigInteger
+from sqlalchemy import Column, Integer, String, BigInteger, Index
 from sqlalchemy.orm import relationship
 
 from src.app.services.subscriber.schemes import Subscriber
@@ -8,10 +8,19 @@ from src.app.services.message.models import MessageModel
 
 class SubscriberModel(Base):
     __tablename__ = "subscribers"
+    __table_args__ = (
+        Index("ix_subscribers_tag_trgm", "tag", postgresql_using="gin", postgresql_ops={"tag": "gin_trgm_ops"}),
+        Index(
+            "ix_subscribers_provider_code_trgm",
+            "provider_code",
+            postgresql_using="gin",
+            postgresql_ops={"provider_code": "gin_trgm_ops"},
+        ),
+    )
     id = Column(Integer, primary_key=True)
     phone = Column(BigInteger, unique=True)
-    provider_code = Column(String)
-    tag = Column(String)
+    provider_code = Column(String, index=True)
+    tag = Column(String, index=True)
     time_zone = Column(String)
     messages = relationship("MessageModel")
 
@@ -1,3 +1,5 @@
+from typing import List, Optional
+
 from pydantic import BaseModel
 
 
@@ -23,5 +25,16 @@ class Subscriber(SubscriberBase):
     id: int
 
 
+class SubscriberPage(BaseModel):
+    items: List[Subscriber]
+    next_cursor: Optional[int] = None
+
+
+class SubscriberImportResult(BaseModel):
+    inserted: int
+    updated: int
+    rejected: int
+
+
 class SubscriberDeletedResponse(BaseModel):
     id: int
@@ -1,11 +1,13 @@
 import logging
-from typing import Generic, Type, Optional, TypeVar, List
+from typing import Generic, Type, Optional, TypeVar, List, Sequence, Tuple
 
 from pydantic import BaseModel
 from sqlalchemy import select, delete
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql import ColumnElement
 
 from src.core.database import Base
+from src.core.metrics import timed
 
 ModelType = TypeVar("ModelType", bound=Base)
 CreateSchemaType = TypeVar("CreateSchemaType", bound=BaseModel)
@@ -17,6 +19,7 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
         self.model = model
         self.logger = logging.getLogger(__name__)
 
+    @timed
     async def get(self, session: AsyncSession, *, id: int) -> Optional[ModelType]:
         stmt = select(self.model).where(
             self.model.id == id
@@ -25,12 +28,44 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
         db_obj = coro.scalar()
         return db_obj
 
+    @timed
     async def get_many(self, session: AsyncSession) -> List[ModelType]:
         stmt = select(self.model)
         coro = await session.execute(stmt)
         db_obj_list = coro.scalars()
         return db_obj_list
 
+    @timed
+    async def get_page(
+        self,
+        session: AsyncSession,
+        *,
+        cursor: Optional[int] = None,
+        limit: int,
+        filters: Sequence[ColumnElement] = (),
+    ) -> Tuple[List[ModelType], Optional[int]]:
+        """
+        Returns a page of objects ordered by id that start after the cursor, and the cursor of the next page
+
+        :param session: AsyncSession
+        :param cursor: Optional[int], id of the last object of the previous page
+        :param limit: int
+        :param filters: Sequence[ColumnElement]
+        :return: Tuple[List[ModelType], Optional[int]], next cursor is None on the last page
+        """
+
+        stmt = select(self.model).where(*filters)
+        if cursor is not None:
+            stmt = stmt.where(self.model.id > cursor)
+        stmt = stmt.order_by(self.model.id).limit(limit + 1)
+        coro = await session.execute(stmt)
+        db_obj_list = coro.scalars().all()
+        if len(db_obj_list) > limit:
+            db_obj_list = db_obj_list[:limit]
+            return db_obj_list, db_obj_list[-1].id
+        return db_obj_list, None
+
+    @timed
     async def save(self, session: AsyncSession, *, obj_in: CreateSchemaType) -> ModelType:
         obj_in_data = obj_in.dict()
         db_obj = self.model(**obj_in_data)
@@ -39,6 +74,7 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
         await session.refresh(db_obj)
         return db_obj
 
+    @timed
     async def update(self, session: AsyncSession, *, db_obj: ModelType, obj_in: UpdateSchemaType) -> ModelType:
         obj_data = db_obj.__dict__
         update_data = obj_in.dict(exclude_unset=True)
@@ -49,6 +85,7 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
         await session.commit()
         return db_obj
 
+    @timed
     async def delete(self, session: AsyncSession, *, id: int) -> Optional[int]:
         stmt = delete(self.model).where(self.model.id == id).returning(self.model.id)
         c = await session.execute(stmt)
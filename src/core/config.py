@@ -1,5 +1,5 @@
 import os
-from typing import List, Union
+from typing import Dict, List, Optional, Union
 
 from pydantic import AnyHttpUrl, BaseSettings, validator
 
@@ -9,6 +9,14 @@ class Settings(BaseSettings):
     BACKEND_CORS_ORIGINS: List[AnyHttpUrl] = []
     AUTH_TOKEN: str
     URL_BASE: str
+    SEND_BATCH_SIZE: int = 1
+    SEND_BATCH_URL: Optional[str] = None
+
+    DRY_RUN: bool = False
+    STUB_LATENCY: float = 0.05
+    STUB_ERROR_RATE: float = 0.0
+    STUB_RATE_LIMIT: Optional[float] = None
+    STUB_PORT: int = 8081
 
     @validator("BACKEND_CORS_ORIGINS", pre=True)
     def assemble_cors_origins(cls, v: Union[str, List[str]]) -> Union[List[str], str]:
@@ -27,6 +35,57 @@ class Settings(BaseSettings):
                          f"{os.getenv('POSTGRES_PASSWORD')}@"
                          f"{os.getenv('POSTGRES_SERVER')}/{os.getenv('POSTGRES_DB')}")
 
+    MAILER_MAX_CONCURRENCY: int = 64
+    MAILING_MAX_PRIORITY: int = 100
+    MAILER_IDLE_DELAY: float = 0.1
+    MAILER_PREFETCH: int = 1000
+    MAILER_PACING_INTERVAL: float = 5
+    MAILER_THROUGHPUT_SMOOTHING: float = 0.3
+    PROGRESS_STREAM_INTERVAL: float = 1.0
+
+    DISPATCHER_MAX_IN_FLIGHT: int = 100
+    DISPATCHER_RATE_LIMIT: Optional[float] = None
+    DISPATCHER_ADAPTIVE: bool = True
+    DISPATCHER_INITIAL_LIMIT: int = 10
+    DISPATCHER_MIN_LIMIT: int = 1
+    DISPATCHER_LIMIT_BACKOFF: float = 0.5
+    DISPATCHER_LATENCY_TOLERANCE: float = 2.0
+    DISPATCHER_RTT_WINDOW: int = 500
+
+    MESSAGE_MAX_ATTEMPTS: int = 5
+    MESSAGE_RETRY_BASE_DELAY: float = 1.0
+    MESSAGE_RETRY_MAX_DELAY: float = 60.0
+
+    BREAKER_WINDOW: int = 50
+    BREAKER_MIN_CALLS: int = 20
+    BREAKER_ERROR_RATE: float = 0.5
+    BREAKER_COOLDOWN: float = 10.0
+
+    PROVIDER_RATE_LIMITS: Dict[str, float] = {}
+    PROVIDER_DEFAULT_RATE_LIMIT: Optional[float] = None
+    # messages a provider may get at once after an idle period, on top of its rate
+    PROVIDER_RATE_BURST: int = 1
+
+    PAGE_LIMIT_DEFAULT: int = 100
+    PAGE_LIMIT_MAX: int = 1000
+
+    SUBSCRIBER_IMPORT_BATCH: int = 10000
+    SUBSCRIBER_EXPORT_BATCH: int = 5000
+
+    MAILING_LEASE_TTL: float = 30
+    MAILING_CLAIM_INTERVAL: float = 5
+    MAILING_CLAIM_LIMIT: int = 10
+
+    MESSAGE_FLUSH_SIZE: int = 500
+    MESSAGE_FLUSH_INTERVAL: float = 1.0
+
+    HTTP_POOL_LIMIT: int = 100
+    HTTP_POOL_LIMIT_PER_HOST: int = 0
+    HTTP_KEEPALIVE_TIMEOUT: float = 30
+    HTTP_DNS_CACHE_TTL: int = 300
+    HTTP_TIMEOUT: float = 10
+    HTTP_CONNECT_TIMEOUT: float = 3
+
     class Config:
         case_sensitive = True
         env_file = ".env"
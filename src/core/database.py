@@ -1,13 +1,43 @@
+import time
+
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import as_declarative, declared_attr
 from sqlalchemy.orm import sessionmaker
 
 from src.core.config import settings
+from src.core.metrics import DB_QUERY_LATENCY
 
 engine = create_async_engine(settings.DATABASE_URI)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine, class_=AsyncSession)
 
 
+class QueryStats:
+    """
+    Number and total duration of statements executed by the process
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+
+query_stats = QueryStats()
+
+
+@event.listens_for(engine.sync_engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context.query_started_at = time.perf_counter()
+
+
+@event.listens_for(engine.sync_engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context.query_started_at
+    query_stats.count += 1
+    query_stats.seconds += elapsed
+    DB_QUERY_LATENCY.observe(elapsed)
+
+
 async def get_db():
     db = SessionLocal()
     try:
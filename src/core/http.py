@@ -0,0 +1,58 @@
+import logging
+from typing import Optional
+
+import aiohttp
+
+from src.core.config import settings
+
+
+class HTTPClient:
+    """
+    Long-lived aiohttp session shared by all mailers, started and closed with the application
+    """
+
+    def __init__(self):
+        self._session: Optional[aiohttp.ClientSession] = None
+        self.logger = logging.getLogger(__name__)
+
+    async def start(self) -> None:
+        """
+        Creates the pooled session
+
+        :return: None
+        """
+
+        connector = aiohttp.TCPConnector(
+            limit=settings.HTTP_POOL_LIMIT,
+            limit_per_host=settings.HTTP_POOL_LIMIT_PER_HOST,
+            keepalive_timeout=settings.HTTP_KEEPALIVE_TIMEOUT,
+            use_dns_cache=True,
+            ttl_dns_cache=settings.HTTP_DNS_CACHE_TTL,
+        )
+        timeout = aiohttp.ClientTimeout(
+            total=settings.HTTP_TIMEOUT,
+            connect=settings.HTTP_CONNECT_TIMEOUT,
+        )
+        self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        self.logger.warning("HTTP client started")
+
+    async def stop(self) -> None:
+        """
+        Closes the session and all pooled connections
+
+        :return: None
+        """
+
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+        self.logger.warning("HTTP client stopped")
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None:
+            raise RuntimeError("HTTP client is not started")
+        return self._session
+
+
+http_client = HTTPClient()
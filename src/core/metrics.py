@@ -0,0 +1,74 @@
+import functools
+import time
+from typing import Callable
+
+from prometheus_client import Counter, Gauge, Histogram
+
+MESSAGES_SENT = Counter(
+    "mailer_messages_total",
+    "Messages sent by mailers of this process by mailing and resulting status",
+    ["mailing_id", "status"],
+)
+MESSAGE_RETRIES = Counter(
+    "mailer_retries_total",
+    "Failed messages scheduled for another attempt",
+)
+UPSTREAM_LATENCY = Histogram(
+    "upstream_request_seconds",
+    "Latency of send requests to the upstream gateway",
+)
+UPSTREAM_RESPONSES = Counter(
+    "upstream_responses_total",
+    "Per-message status codes returned by the upstream gateway, none if no response was received",
+    ["code"],
+)
+DB_QUERY_LATENCY = Histogram(
+    "db_query_seconds",
+    "Latency of database statements",
+)
+DB_METHOD_LATENCY = Histogram(
+    "db_method_seconds",
+    "Latency of database service methods",
+    ["method"],
+)
+SCHEDULER_QUEUE_SIZE = Gauge(
+    "scheduler_queue_size",
+    "Mailings waiting for their start time in the scheduler of this process",
+)
+ACTIVE_MAILERS = Gauge(
+    "mailers_active",
+    "Mailers running in this process",
+)
+DISPATCHER_LIMIT = Gauge(
+    "dispatcher_limit",
+    "Current limit of concurrent sends",
+)
+DISPATCHER_IN_FLIGHT = Gauge(
+    "dispatcher_in_flight",
+    "Sends in flight",
+)
+
+
+def timed(func: Callable) -> Callable:
+    """
+    Records duration of an async method that queries the database in DB_METHOD_LATENCY,
+    labeled with the class of the instance and method name
+
+    :param func: Callable
+    :return: Callable
+    """
+
+    histograms = {}
+
+    @functools.wraps(func)
+    async def wrapper(self, *args, **kwargs):
+        started_at = time.perf_counter()
+        try:
+            return await func(self, *args, **kwargs)
+        finally:
+            cls = type(self)
+            if cls not in histograms:
+                histograms[cls] = DB_METHOD_LATENCY.labels(f"{cls.__name__}.{func.__name__}")
+            histograms[cls].observe(time.perf_counter() - started_at)
+
+    return wrapper
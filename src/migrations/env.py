@@ -9,7 +9,7 @@ from alembic import context
 from src.core.database import Base
 from src.app.services.subscriber.models import SubscriberModel
 from src.app.services.mailing.models import MailingModel
-from src.app.services.message.models import MessageModel
+from src.app.services.message.models import MessageModel, MailingStatsModel
 
 config = context.config
 fileConfig(config.config_file_name)
@@ -0,0 +1,25 @@
+"""message attempts
+
+Revision ID: 1a9f3e6c8b54
+Revises: e7b2c6f41d95
+Create Date: 2026-10-18 15:10:43.380127
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1a9f3e6c8b54'
+down_revision = 'e7b2c6f41d95'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('messages', sa.Column('attempts', sa.Integer(), server_default='0', nullable=False))
+    op.execute("UPDATE messages SET attempts = 1 WHERE status != 'pending'")
+
+
+def downgrade():
+    op.drop_column('messages', 'attempts')
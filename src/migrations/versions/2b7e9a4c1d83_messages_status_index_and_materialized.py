@@ -0,0 +1,28 @@
+"""messages status index and mailing materialized_at
+
+Revision ID: 2b7e9a4c1d83
+Revises: 6c2d8f0e4b91
+Create Date: 2026-10-18 17:58:12.640318
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2b7e9a4c1d83'
+down_revision = '6c2d8f0e4b91'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_messages_mailing_id_status', 'messages', ['mailing_id', 'status'], unique=False)
+    op.add_column('mailings', sa.Column('materialized_at', sa.DateTime(timezone=False), nullable=True))
+    # mailings that have already started have their messages
+    op.execute("UPDATE mailings SET materialized_at = start_time WHERE state <> 'scheduled'")
+
+
+def downgrade():
+    op.drop_column('mailings', 'materialized_at')
+    op.drop_index('ix_messages_mailing_id_status', table_name='messages')
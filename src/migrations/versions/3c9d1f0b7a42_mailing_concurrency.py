@@ -0,0 +1,26 @@
+"""mailing concurrency and rate limit
+
+Revision ID: 3c9d1f0b7a42
+Revises: a61fa2c15990
+Create Date: 2026-10-18 10:12:04.118305
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c9d1f0b7a42'
+down_revision = 'a61fa2c15990'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('mailings', sa.Column('concurrency', sa.Integer(), server_default='1', nullable=False))
+    op.add_column('mailings', sa.Column('rate_limit', sa.Float(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('mailings', 'rate_limit')
+    op.drop_column('mailings', 'concurrency')
@@ -0,0 +1,46 @@
+"""subscriber audience indexes and mailing filter mode
+
+Revision ID: 5f1e7b3a9c28
+Revises: c4a8e1d92f07
+Create Date: 2026-10-18 13:05:52.217730
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5f1e7b3a9c28'
+down_revision = 'c4a8e1d92f07'
+branch_labels = None
+depends_on = None
+
+filter_mode = sa.Enum('exact', 'substring', name='filtermode')
+
+
+def upgrade():
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.create_index('ix_subscribers_tag', 'subscribers', ['tag'], unique=False)
+    op.create_index('ix_subscribers_provider_code', 'subscribers', ['provider_code'], unique=False)
+    op.create_index(
+        'ix_subscribers_tag_trgm', 'subscribers', ['tag'], unique=False,
+        postgresql_using='gin', postgresql_ops={'tag': 'gin_trgm_ops'},
+    )
+    op.create_index(
+        'ix_subscribers_provider_code_trgm', 'subscribers', ['provider_code'], unique=False,
+        postgresql_using='gin', postgresql_ops={'provider_code': 'gin_trgm_ops'},
+    )
+
+    # existing mailings keep substring matching they were created with, new ones default to exact
+    filter_mode.create(op.get_bind())
+    op.add_column('mailings', sa.Column('filter_mode', filter_mode, server_default='substring', nullable=False))
+    op.alter_column('mailings', 'filter_mode', server_default='exact')
+
+
+def downgrade():
+    op.drop_column('mailings', 'filter_mode')
+    filter_mode.drop(op.get_bind())
+    op.drop_index('ix_subscribers_provider_code_trgm', table_name='subscribers')
+    op.drop_index('ix_subscribers_tag_trgm', table_name='subscribers')
+    op.drop_index('ix_subscribers_provider_code', table_name='subscribers')
+    op.drop_index('ix_subscribers_tag', table_name='subscribers')
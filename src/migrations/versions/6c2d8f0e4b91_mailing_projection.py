@@ -0,0 +1,26 @@
+"""mailing projection
+
+Revision ID: 6c2d8f0e4b91
+Revises: b3e58d1f6a70
+Create Date: 2026-10-18 17:21:37.204915
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6c2d8f0e4b91'
+down_revision = 'b3e58d1f6a70'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('mailings', sa.Column('projected_finish_at', sa.DateTime(timezone=False), nullable=True))
+    op.add_column('mailings', sa.Column('projected_undelivered', sa.Integer(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('mailings', 'projected_undelivered')
+    op.drop_column('mailings', 'projected_finish_at')
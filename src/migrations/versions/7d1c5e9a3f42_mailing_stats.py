@@ -0,0 +1,42 @@
+"""mailing stats counters
+
+Revision ID: 7d1c5e9a3f42
+Revises: f0a6d3b8e215
+Create Date: 2026-10-18 19:12:26.357091
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d1c5e9a3f42'
+down_revision = 'f0a6d3b8e215'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'mailing_stats',
+        sa.Column('mailing_id', sa.Integer(), nullable=False),
+        sa.Column('pending', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('delivered', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('failed', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('attempts', sa.Integer(), server_default='0', nullable=False),
+        sa.ForeignKeyConstraint(['mailing_id'], ['mailings.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('mailing_id'),
+    )
+    op.execute(
+        "INSERT INTO mailing_stats (mailing_id, pending, delivered, failed, attempts) "
+        "SELECT mailing_id, "
+        "count(*) FILTER (WHERE status = 'pending'), "
+        "count(*) FILTER (WHERE status = 'delivered'), "
+        "count(*) FILTER (WHERE status = 'failed'), "
+        "coalesce(sum(attempts), 0) "
+        "FROM messages WHERE mailing_id IS NOT NULL GROUP BY mailing_id"
+    )
+
+
+def downgrade():
+    op.drop_table('mailing_stats')
@@ -0,0 +1,28 @@
+"""unique message per mailing and subscriber
+
+Revision ID: 8e27b4d5c613
+Revises: 3c9d1f0b7a42
+Create Date: 2026-10-18 11:02:47.530921
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '8e27b4d5c613'
+down_revision = '3c9d1f0b7a42'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # keep only the latest message of each (mailing, subscriber) pair before adding the constraint
+    op.execute(
+        "DELETE FROM messages a USING messages b "
+        "WHERE a.mailing_id = b.mailing_id AND a.subscriber_id = b.subscriber_id AND a.id < b.id"
+    )
+    op.create_unique_constraint('uq_messages_mailing_subscriber', 'messages', ['mailing_id', 'subscriber_id'])
+
+
+def downgrade():
+    op.drop_constraint('uq_messages_mailing_subscriber', 'messages', type_='unique')
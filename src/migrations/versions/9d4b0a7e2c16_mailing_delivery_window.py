@@ -0,0 +1,26 @@
+"""mailing delivery window
+
+Revision ID: 9d4b0a7e2c16
+Revises: 1a9f3e6c8b54
+Create Date: 2026-10-18 15:57:21.049312
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d4b0a7e2c16'
+down_revision = '1a9f3e6c8b54'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('mailings', sa.Column('window_start', sa.Time(), nullable=True))
+    op.add_column('mailings', sa.Column('window_end', sa.Time(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('mailings', 'window_end')
+    op.drop_column('mailings', 'window_start')
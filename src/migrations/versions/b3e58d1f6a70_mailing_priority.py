@@ -0,0 +1,24 @@
+"""mailing priority
+
+Revision ID: b3e58d1f6a70
+Revises: 9d4b0a7e2c16
+Create Date: 2026-10-18 16:44:09.812556
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b3e58d1f6a70'
+down_revision = '9d4b0a7e2c16'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('mailings', sa.Column('priority', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade():
+    op.drop_column('mailings', 'priority')
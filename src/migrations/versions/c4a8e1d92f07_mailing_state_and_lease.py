@@ -0,0 +1,35 @@
+"""mailing state and lease
+
+Revision ID: c4a8e1d92f07
+Revises: 8e27b4d5c613
+Create Date: 2026-10-18 12:21:15.904466
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4a8e1d92f07'
+down_revision = '8e27b4d5c613'
+branch_labels = None
+depends_on = None
+
+mailing_state = sa.Enum('scheduled', 'running', 'finished', name='mailingstate')
+
+
+def upgrade():
+    mailing_state.create(op.get_bind())
+    op.add_column('mailings', sa.Column('state', mailing_state, server_default='scheduled', nullable=False))
+    op.add_column('mailings', sa.Column('lease_owner', sa.String(), nullable=True))
+    op.add_column('mailings', sa.Column('lease_expires_at', sa.DateTime(), nullable=True))
+    op.execute("UPDATE mailings SET state = 'finished' WHERE end_time < now()")
+    op.create_index('ix_mailings_state_start_time', 'mailings', ['state', 'start_time'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_mailings_state_start_time', table_name='mailings')
+    op.drop_column('mailings', 'lease_expires_at')
+    op.drop_column('mailings', 'lease_owner')
+    op.drop_column('mailings', 'state')
+    mailing_state.drop(op.get_bind())
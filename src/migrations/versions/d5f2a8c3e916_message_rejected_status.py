@@ -0,0 +1,30 @@
+"""rejected message status
+
+Revision ID: d5f2a8c3e916
+Revises: 7d1c5e9a3f42
+Create Date: 2026-10-18 21:05:13.482907
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd5f2a8c3e916'
+down_revision = '7d1c5e9a3f42'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # messages rejected before this revision stay failed, they can't be told from exhausted retries
+    with op.get_context().autocommit_block():
+        op.execute("ALTER TYPE messagestatus ADD VALUE IF NOT EXISTS 'rejected'")
+    op.add_column('mailing_stats', sa.Column('rejected', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade():
+    # enum values can't be dropped, rejected messages are moved back to failed
+    op.execute("UPDATE messages SET status = 'failed' WHERE status = 'rejected'")
+    op.execute("UPDATE mailing_stats SET failed = failed + rejected")
+    op.drop_column('mailing_stats', 'rejected')
@@ -0,0 +1,23 @@
+"""messages keyset index
+
+Revision ID: e7b2c6f41d95
+Revises: 5f1e7b3a9c28
+Create Date: 2026-10-18 13:48:30.661204
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7b2c6f41d95'
+down_revision = '5f1e7b3a9c28'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_messages_mailing_id_id', 'messages', ['mailing_id', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_messages_mailing_id_id', table_name='messages')
@@ -0,0 +1,30 @@
+"""mailing pause, cancel and checkpoint
+
+Revision ID: f0a6d3b8e215
+Revises: 2b7e9a4c1d83
+Create Date: 2026-10-18 18:37:50.118462
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f0a6d3b8e215'
+down_revision = '2b7e9a4c1d83'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        op.execute("ALTER TYPE mailingstate ADD VALUE IF NOT EXISTS 'paused'")
+        op.execute("ALTER TYPE mailingstate ADD VALUE IF NOT EXISTS 'canceled'")
+    op.add_column('mailings', sa.Column('resume_after_id', sa.Integer(), nullable=True))
+
+
+def downgrade():
+    # enum values can't be dropped, mailings using them are moved to the closest older state
+    op.execute("UPDATE mailings SET state = 'scheduled' WHERE state = 'paused'")
+    op.execute("UPDATE mailings SET state = 'finished' WHERE state = 'canceled'")
+    op.drop_column('mailings', 'resume_after_id')
@@ -0,0 +1,13 @@
+import os
+
+# settings are read at import time, these let the modules under test be imported without a .env
+for name, value in {
+    "PROJECT_NAME": "test",
+    "AUTH_TOKEN": "test",
+    "URL_BASE": "http://localhost",
+    "POSTGRES_SERVER": "localhost",
+    "POSTGRES_USER": "postgres",
+    "POSTGRES_PASSWORD": "postgres",
+    "POSTGRES_DB": "test",
+}.items():
+    os.environ.setdefault(name, value)
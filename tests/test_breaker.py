@@ -0,0 +1,91 @@
+import asyncio
+
+from src.app.services.mailing.breaker import BreakerState, CircuitBreaker
+
+
+def make_breaker(**kwargs) -> CircuitBreaker:
+    params = dict(name="test", window=10, min_calls=4, threshold=0.5, cooldown=0.05, poll=0.01)
+    params.update(kwargs)
+    return CircuitBreaker(**params)
+
+
+def open_breaker(breaker: CircuitBreaker) -> None:
+    for _ in range(breaker.min_calls):
+        breaker.record(success=False)
+
+
+def test_stays_closed_below_min_calls():
+    breaker = make_breaker()
+    for _ in range(breaker.min_calls - 1):
+        breaker.record(success=False)
+    assert breaker.state == BreakerState.closed
+
+
+def test_opens_at_threshold():
+    breaker = make_breaker()
+    breaker.record(success=True)
+    breaker.record(success=True)
+    breaker.record(success=False)
+    assert breaker.state == BreakerState.closed
+    breaker.record(success=False)
+    assert breaker.state == BreakerState.open
+
+
+def test_closed_wait_is_not_a_probe():
+    assert asyncio.run(make_breaker().wait()) is False
+
+
+def test_probe_success_closes():
+    async def run():
+        breaker = make_breaker()
+        open_breaker(breaker)
+        assert await breaker.wait() is True
+        assert breaker.state == BreakerState.half_open
+        breaker.record(success=True)
+        assert breaker.state == BreakerState.closed
+        assert await breaker.wait() is False
+
+    asyncio.run(run())
+
+
+def test_probe_failure_opens_again():
+    async def run():
+        breaker = make_breaker()
+        open_breaker(breaker)
+        assert await breaker.wait() is True
+        breaker.record(success=False)
+        assert breaker.state == BreakerState.open
+
+    asyncio.run(run())
+
+
+def test_single_probe_while_half_open():
+    async def run():
+        breaker = make_breaker()
+        open_breaker(breaker)
+        assert await breaker.wait() is True
+        second = asyncio.create_task(breaker.wait())
+        await asyncio.sleep(breaker.poll * 3)
+        assert not second.done()
+        breaker.record(success=True)
+        assert await asyncio.wait_for(second, timeout=1) is False
+
+    asyncio.run(run())
+
+
+def test_aborted_probe_lets_another_call_probe():
+    async def run():
+        breaker = make_breaker()
+        open_breaker(breaker)
+        assert await breaker.wait() is True
+        breaker.abort_probe()
+        assert breaker.state == BreakerState.half_open
+        assert await asyncio.wait_for(breaker.wait(), timeout=1) is True
+
+    asyncio.run(run())
+
+
+def test_abort_probe_does_nothing_when_closed():
+    breaker = make_breaker()
+    breaker.abort_probe()
+    assert breaker.state == BreakerState.closed
@@ -0,0 +1,46 @@
+import asyncio
+import datetime
+
+from src.app.services.message.buffer import StatusBuffer
+from src.app.services.message.models import MessageStatus
+
+
+def test_full_buffer_flush_failure_keeps_rows():
+    async def run():
+        written = []
+        fail = True
+
+        async def writer(rows):
+            if fail:
+                raise RuntimeError("database is down")
+            written.extend(rows)
+
+        buffer = StatusBuffer(writer=writer, flush_size=2, flush_interval=1)
+        now = datetime.datetime.now()
+        await buffer.add(message_id=1, status=MessageStatus.delivered, sent_at=now, attempts=1)
+        await buffer.add(message_id=2, status=MessageStatus.failed, sent_at=now, attempts=1)
+        assert len(buffer) == 2
+
+        fail = False
+        await buffer.flush()
+        assert sorted(row["b_id"] for row in written) == [1, 2]
+        assert len(buffer) == 0
+
+    asyncio.run(run())
+
+
+def test_latest_transition_wins():
+    async def run():
+        written = []
+
+        async def writer(rows):
+            written.extend(rows)
+
+        buffer = StatusBuffer(writer=writer, flush_size=10, flush_interval=1)
+        now = datetime.datetime.now()
+        await buffer.add(message_id=1, status=MessageStatus.failed, sent_at=now, attempts=1)
+        await buffer.add(message_id=1, status=MessageStatus.delivered, sent_at=now, attempts=2)
+        await buffer.flush()
+        assert written == [{"b_id": 1, "b_status": MessageStatus.delivered, "b_sent_at": now, "b_attempts": 2}]
+
+    asyncio.run(run())
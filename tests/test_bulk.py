@@ -0,0 +1,21 @@
+import asyncio
+
+from src.app.services.subscriber.bulk import PHONE_MAX, BulkFormat, read_records, to_record
+
+
+def test_phone_must_fit_bigint():
+    assert to_record([PHONE_MAX, "900", "tag", "UTC"]) == (PHONE_MAX, "900", "tag", "UTC")
+    assert to_record([PHONE_MAX + 1, "900", "tag", "UTC"]) is None
+    assert to_record(["0", "900", "tag", "UTC"]) is None
+    assert to_record([True, "900", "tag", "UTC"]) is None
+
+
+def test_read_records_rejects_oversized_phone():
+    async def chunks():
+        yield b"phone,provider_code,tag,time_zone\n79001234567,900,a,UTC\n"
+        yield f"{PHONE_MAX + 1},900,b,UTC\n".encode()
+
+    async def run():
+        return [r async for r in read_records(chunks(), fmt=BulkFormat.csv)]
+
+    assert asyncio.run(run()) == [(79001234567, "900", "a", "UTC"), None]
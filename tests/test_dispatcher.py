@@ -0,0 +1,60 @@
+import asyncio
+from collections import Counter
+
+from src.app.services.mailing.dispatcher import Dispatcher
+
+
+def test_grants_up_to_max_in_flight():
+    async def run():
+        dispatcher = Dispatcher(max_in_flight=2, rate=None)
+        await dispatcher.acquire(mailing_id=1, weight=1)
+        await dispatcher.acquire(mailing_id=1, weight=1)
+        third = asyncio.create_task(dispatcher.acquire(mailing_id=1, weight=1))
+        await asyncio.sleep(0)
+        assert not third.done()
+        assert dispatcher.waiting == 1
+        dispatcher.release()
+        await asyncio.wait_for(third, timeout=1)
+        assert dispatcher.in_flight == 2
+
+    asyncio.run(run())
+
+
+def test_cancelled_waiter_is_skipped():
+    async def run():
+        dispatcher = Dispatcher(max_in_flight=1, rate=None)
+        await dispatcher.acquire(mailing_id=1, weight=1)
+        cancelled = asyncio.create_task(dispatcher.acquire(mailing_id=1, weight=1))
+        waiting = asyncio.create_task(dispatcher.acquire(mailing_id=2, weight=1))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await asyncio.sleep(0)
+        dispatcher.release()
+        await asyncio.wait_for(waiting, timeout=1)
+        assert dispatcher.in_flight == 1
+
+    asyncio.run(run())
+
+
+def test_weighted_fair_share():
+    async def run():
+        dispatcher = Dispatcher(max_in_flight=1, rate=None)
+        granted = []
+
+        async def send(mailing_id: int, weight: float):
+            async with dispatcher.slot(mailing_id=mailing_id, weight=weight):
+                granted.append(mailing_id)
+                await asyncio.sleep(0)
+
+        await dispatcher.acquire(mailing_id=0, weight=1)
+        tasks = [asyncio.create_task(send(1, 1)) for _ in range(40)]
+        tasks += [asyncio.create_task(send(2, 3)) for _ in range(40)]
+        await asyncio.sleep(0)
+        dispatcher.release()
+        await asyncio.gather(*tasks)
+        # while both are backlogged the heavier mailing gets three times the slots
+        shares = Counter(granted[:40])
+        assert shares[2] == 30
+        assert shares[1] == 10
+
+    asyncio.run(run())
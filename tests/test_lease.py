@@ -0,0 +1,71 @@
+import asyncio
+import datetime
+
+from src.app.services.mailing.lease import Lease, MailingLeases
+from src.app.services.mailing.schemes import Mailing
+
+
+def make_lease(ttl: float) -> Lease:
+    now = datetime.datetime.now()
+    mailing = Mailing(
+        id=1,
+        mail_text="text",
+        user_filter="tag",
+        start_time=now,
+        end_time=now + datetime.timedelta(hours=1),
+    )
+    return Lease(mailing=mailing, token="owner:token", expires_at=asyncio.get_running_loop().time() + ttl)
+
+
+def make_leases(ttl: float) -> MailingLeases:
+    leases = MailingLeases()
+    leases.renew_interval = ttl / 4
+    return leases
+
+
+def test_keep_returns_when_lease_is_lost():
+    async def run():
+        leases = make_leases(ttl=0.4)
+        lease = make_lease(ttl=0.4)
+        calls = []
+
+        async def renew():
+            calls.append(1)
+            return len(calls) < 3
+
+        renewed = []
+        await asyncio.wait_for(leases.keep(lease=lease, renew=renew, on_renewed=lambda: renewed.append(1)), 2)
+        assert len(calls) == 3
+        assert len(renewed) == 2
+
+    asyncio.run(run())
+
+
+def test_keep_gives_up_before_lease_expires():
+    async def run():
+        leases = make_leases(ttl=0.4)
+        lease = make_lease(ttl=0.4)
+        loop = asyncio.get_running_loop()
+
+        async def renew():
+            raise ConnectionError("database is down")
+
+        await asyncio.wait_for(leases.keep(lease=lease, renew=renew), 2)
+        assert loop.time() < lease.expires_at
+
+    asyncio.run(run())
+
+
+def test_keep_gives_up_when_renewals_hang():
+    async def run():
+        leases = make_leases(ttl=0.4)
+        lease = make_lease(ttl=0.4)
+        loop = asyncio.get_running_loop()
+
+        async def renew():
+            await asyncio.sleep(10)
+
+        await asyncio.wait_for(leases.keep(lease=lease, renew=renew), 2)
+        assert loop.time() < lease.expires_at
+
+    asyncio.run(run())
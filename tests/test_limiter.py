@@ -0,0 +1,102 @@
+import asyncio
+import time
+
+from src.app.services.mailing.dispatcher import Dispatcher, pool_bounded
+from src.app.services.mailing.limiter import AdaptiveLimiter
+from src.core.config import settings
+
+
+def make_limiter(**kwargs) -> AdaptiveLimiter:
+    params = dict(initial=10, min_limit=1, max_limit=20, backoff=0.5, tolerance=2.0, rtt_window=100)
+    params.update(kwargs)
+    return AdaptiveLimiter(**params)
+
+
+def test_initial_limit_is_clamped():
+    assert make_limiter(initial=50).limit == 20
+    assert make_limiter(initial=0).limit == 1
+
+
+def test_grows_by_one_per_round_when_saturated():
+    limiter = make_limiter()
+    for _ in range(11):
+        limiter.record(started_at=time.monotonic(), latency=0.01, overloaded=False, in_flight=limiter.limit)
+    assert limiter.limit == 11
+
+
+def test_doesnt_grow_when_not_saturated():
+    limiter = make_limiter()
+    for _ in range(100):
+        limiter.record(started_at=time.monotonic(), latency=0.01, overloaded=False, in_flight=1)
+    assert limiter.limit == 10
+
+
+def test_never_exceeds_max_limit():
+    limiter = make_limiter()
+    for _ in range(1000):
+        limiter.record(started_at=time.monotonic(), latency=0.01, overloaded=False, in_flight=limiter.limit)
+    assert limiter.limit == 20
+
+
+def test_overload_cuts_once_per_round():
+    limiter = make_limiter()
+    started_at = time.monotonic()
+    limiter.record(started_at=started_at, latency=0.01, overloaded=True, in_flight=10)
+    assert limiter.limit == 5
+    # sends started before the cut don't cut again
+    limiter.record(started_at=started_at, latency=0.01, overloaded=True, in_flight=10)
+    assert limiter.limit == 5
+    limiter.record(started_at=time.monotonic(), latency=0.01, overloaded=True, in_flight=5)
+    assert limiter.limit == 2
+
+
+def test_never_below_min_limit():
+    limiter = make_limiter(min_limit=3)
+    for _ in range(10):
+        limiter.record(started_at=time.monotonic(), latency=0.01, overloaded=True, in_flight=1)
+    assert limiter.limit == 3
+
+
+def test_slow_response_cuts():
+    limiter = make_limiter()
+    limiter.record(started_at=time.monotonic(), latency=0.01, overloaded=False, in_flight=1)
+    limiter.record(started_at=time.monotonic(), latency=0.05, overloaded=False, in_flight=1)
+    assert limiter.limit == 5
+    assert limiter.min_rtt == 0.01
+
+
+def test_min_rtt_follows_the_window():
+    limiter = make_limiter(rtt_window=3)
+    limiter.record(started_at=time.monotonic(), latency=0.01, overloaded=False, in_flight=1)
+    for _ in range(5):
+        limiter.record(started_at=time.monotonic(), latency=0.015, overloaded=False, in_flight=1)
+    assert limiter.min_rtt == 0.015
+
+
+def test_adaptive_limit_caps_in_flight():
+    async def run():
+        limiter = AdaptiveLimiter(initial=1, min_limit=1, max_limit=10, backoff=0.5, tolerance=2, rtt_window=100)
+        dispatcher = Dispatcher(max_in_flight=10, rate=None, limiter=limiter)
+        assert dispatcher.limit == 1
+        await dispatcher.acquire(mailing_id=1, weight=1)
+        second = asyncio.create_task(dispatcher.acquire(mailing_id=1, weight=1))
+        await asyncio.sleep(0)
+        assert not second.done()
+        dispatcher.release()
+        await asyncio.wait_for(second, timeout=1)
+
+    asyncio.run(run())
+
+
+def test_pool_bounded(monkeypatch):
+    monkeypatch.setattr(settings, "HTTP_POOL_LIMIT", 100)
+    monkeypatch.setattr(settings, "HTTP_POOL_LIMIT_PER_HOST", 0)
+    assert pool_bounded(200) == 100
+    assert pool_bounded(50) == 50
+
+    monkeypatch.setattr(settings, "HTTP_POOL_LIMIT_PER_HOST", 30)
+    assert pool_bounded(200) == 30
+
+    monkeypatch.setattr(settings, "HTTP_POOL_LIMIT", 0)
+    monkeypatch.setattr(settings, "HTTP_POOL_LIMIT_PER_HOST", 0)
+    assert pool_bounded(200) == 200
@@ -0,0 +1,10 @@
+from src.app.services.mailing.mailer import is_misconfigured, is_rejected, is_transient
+
+
+def test_status_code_classes():
+    for code in (None, 408, 429, 500, 503):
+        assert is_transient(code) and not is_rejected(code) and not is_misconfigured(code)
+    for code in (400, 422):
+        assert is_rejected(code) and not is_transient(code) and not is_misconfigured(code)
+    for code in (401, 403, 404, 405):
+        assert is_misconfigured(code) and not is_transient(code) and not is_rejected(code)
@@ -0,0 +1,23 @@
+import asyncio
+
+from src.app.services.mailing.ratelimit import ProviderRateLimiter
+
+
+def test_idle_provider_gets_at_most_burst_messages_at_once():
+    async def run():
+        limiter = ProviderRateLimiter(rates={"900": 100}, default_rate=None, burst=2)
+        await limiter.acquire("900")
+        await asyncio.sleep(0.1)
+        bucket = limiter._buckets["900"]
+        assert [bucket.try_acquire() for _ in range(3)] == [True, True, False]
+
+    asyncio.run(run())
+
+
+def test_provider_without_rate_isnt_limited():
+    async def run():
+        limiter = ProviderRateLimiter(rates={}, default_rate=None, burst=1)
+        await asyncio.wait_for(asyncio.gather(*(limiter.acquire("900") for _ in range(100))), 1)
+        assert limiter._buckets["900"] is None
+
+    asyncio.run(run())
@@ -0,0 +1,61 @@
+import asyncio
+
+from aiohttp import web
+
+from src.app.services.mailing.transport import BatchTransport
+from src.app.services.message.schemes import QueuedMessage
+from src.core.http import http_client
+
+
+def make_messages(ids):
+    return [
+        QueuedMessage(id=i, subscriber_id=i, phone=79000000000 + i, provider_code="900", time_zone=None, attempts=0)
+        for i in ids
+    ]
+
+
+async def send_batch(handler, messages):
+    app = web.Application()
+    app.router.add_post("/send", handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    await http_client.start()
+    try:
+        transport = BatchTransport(batch_size=len(messages), url=f"http://127.0.0.1:{port}/send")
+        return await transport.send(messages, text="text")
+    finally:
+        await http_client.stop()
+        await runner.cleanup()
+
+
+def test_malformed_batch_is_split_until_the_bad_message():
+    requests = []
+
+    async def handler(request):
+        body = await request.json()
+        ids = [m["id"] for m in body["messages"]]
+        requests.append(ids)
+        if 3 in ids:
+            return web.Response(status=400)
+        return web.json_response({"results": [{"id": i, "status": 200} for i in ids]})
+
+    statuses = asyncio.run(send_batch(handler, make_messages(range(1, 5))))
+    assert statuses == [200, 200, 400, 200]
+    assert requests[0] == [1, 2, 3, 4]
+
+
+def test_request_errors_apply_to_every_message():
+    async def handler(request):
+        return web.Response(status=401)
+
+    assert asyncio.run(send_batch(handler, make_messages(range(1, 4)))) == [401, 401, 401]
+
+
+def test_too_large_single_message_is_retried():
+    async def handler(request):
+        return web.Response(status=413)
+
+    assert asyncio.run(send_batch(handler, make_messages(range(1, 3)))) == [None, None]